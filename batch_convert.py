@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import image_processing as ip
+from dot_render import render_png
+from gcode_optimizer import optimize_gcode
+from gcode_sim import simulate_file, format_duration
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+OUTPUT_DIR = "output"
+DEFAULT_SIZE = (330, 415)
+DEFAULT_REGION = 5
+
+
+def find_images(inputs):
+    """
+    Expands files and directories (non-recursively) into a sorted list of image paths.
+    A file reached twice (listed and inside a listed directory) is only kept once.
+    """
+    images, seen = [], set()
+    for path in inputs:
+        if os.path.isdir(path):
+            found = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                     if name.lower().endswith(IMAGE_EXTENSIONS)]
+        elif os.path.isfile(path):
+            found = [path]
+        else:
+            print(f"⚠️ Skipping {path}: not found")
+            continue
+        for image_path in found:
+            if os.path.realpath(image_path) not in seen:
+                seen.add(os.path.realpath(image_path))
+                images.append(image_path)
+    return images
+
+
+def image_key(image_path):
+    """
+    The image's path relative to the working directory, with / separators: the same
+    for a file however it was listed, and distinct for same-named files in different
+    directories (a bare basename isn't).
+    """
+    return os.path.relpath(image_path).replace(os.sep, "/")
+
+
+def output_stems(images):
+    """
+    Output name stem per image: its file name without extension, plus a short hash of
+    its path when another image in the batch has the same stem (photos/a.jpg and
+    scans/a.png would otherwise overwrite each other's .gcode and .png).
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in images]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    return [stem if counts[stem] == 1 else f"{stem}_{hashlib.sha1(image_key(path).encode()).hexdigest()[:6]}"
+            for stem, path in zip(stems, images)]
+
+
+def job_seed(base_seed, image_path, output_size, region_size):
+    """
+    Seed for one job, derived from the job itself so adding images to a batch
+    doesn't change the dot matrices of the others.
+    """
+    key = f"{base_seed}|{image_key(image_path)}|{output_size[0]}x{output_size[1]}|r{region_size}"
+    return zlib.crc32(key.encode())
+
+
+def make_jobs(images, sizes, regions, base_seed, output_dir):
+    """
+    One job per image, size and region size. Raises ValueError if two jobs would still
+    write the same output file.
+    """
+    jobs = []
+    for image_path, stem in zip(images, output_stems(images)):
+        for size in sizes:
+            for region_size in regions:
+                name = f"{stem}_{size[0]}x{size[1]}_r{region_size}"
+                jobs.append({
+                    "image_path": image_path,
+                    "output_size": size,
+                    "region_size": region_size,
+                    "seed": job_seed(base_seed, image_path, size, region_size),
+                    "output_path": os.path.join(output_dir, name + ".gcode"),
+                })
+    outputs = {}
+    for job in jobs:
+        other = outputs.setdefault(job["output_path"], job["image_path"])
+        if other != job["image_path"]:
+            raise ValueError(f"{other} and {job['image_path']} would both write {job['output_path']}")
+    return jobs
+
+
+def convert(job, alpha=10, color_space="oklab", optimize_path=False, time_budget=1.0, stroke_mode=False,
+            color_order="light-to-dark", max_dots_per_color=None, optimize_gcode_output=False, keep_dots=False,
+            render=False):
+    """
+    Runs one image -> G-code job (in a worker process) and returns its summary row.
+    With render, a PNG preview with the toolpath is written next to the G-code.
+    """
+    start = time.perf_counter()
+    _, dot_matrix = ip.load_and_quantize_cached(job["image_path"], output_size=job["output_size"],
+                                                region_size=job["region_size"], alpha=alpha, seed=job["seed"],
+                                                color_space=color_space)
+    # Keep the planner's per-color chatter from interleaving across workers
+    with contextlib.redirect_stdout(io.StringIO()):
+        gcode = ip.iter_pointillism_gcode(dot_matrix, optimize_path=optimize_path, time_budget=time_budget,
+                                          stroke_mode=stroke_mode, color_order=color_order,
+                                          max_dots_per_color=max_dots_per_color)
+        if optimize_gcode_output:
+            gcode = optimize_gcode(gcode)
+        lines = ip.write_gcode(gcode, job["output_path"])
+    report = simulate_file(job["output_path"])
+    if render:
+        render_png(dot_matrix, os.path.splitext(job["output_path"])[0] + ".png", job["output_path"])
+
+    used = [int(c) for c in sorted(set(dot_matrix.ravel().tolist()))]
+    return dict(job,
+                lines=lines,
+                dots=report["dots"] + report["stroke_cells"],
+                colors=used,
+                pauses=report["color_changes"],
+                paint_time=report["total_time"],
+                wall_s=time.perf_counter() - start,
+                dot_matrix=dot_matrix if keep_dots else None)
+
+
+def format_table(rows):
+    header = f"{'output':<36} {'seed':>10} {'dots':>7} {'colors':>6} {'pauses':>6}  {'est. time':>12} {'wall':>7}"
+    out = [header, "-" * len(header)]
+    for row in rows:
+        out.append(f"{os.path.basename(row['output_path']):<36} {row['seed']:>10} {row['dots']:>7} "
+                   f"{len(row['colors']):>6} {row['pauses']:>6}  {format_duration(row['paint_time']):>12} {row['wall_s']:>6.1f}s")
+    if rows:
+        total = sum(row["paint_time"] for row in rows)
+        out.append("-" * len(header))
+        out.append(f"{len(rows)} jobs, {sum(row['dots'] for row in rows)} dots, estimated {format_duration(total)} of painting")
+    return "\n".join(out)
+
+
+def run_batch(jobs, workers=None, **convert_kwargs):
+    """
+    Fans jobs out over a process pool. Returns (rows in job order, failures).
+    """
+    if convert_kwargs.get("color_space", "oklab") == "oklab":
+        # Build the palette LUT once up front instead of in every worker at the same time
+        ip.load_palette_lut(alpha=convert_kwargs.get("alpha", 10))
+    rows, failures = {}, []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert, job, **convert_kwargs): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            job = jobs[futures[future]]
+            try:
+                rows[futures[future]] = row = future.result()
+                print(f"✅ {os.path.basename(row['output_path'])} ({row['wall_s']:.1f} s)")
+            except Exception as e:
+                failures.append((job, e))
+                print(f"❌ {job['image_path']} {job['output_size']} r{job['region_size']}: {e}")
+    return [rows[i] for i in sorted(rows)], failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert images to pointillism G-code in parallel.")
+    parser.add_argument("inputs", nargs="+", help="image files and/or directories of images")
+    parser.add_argument("--sizes", nargs="+", default=None, help="output sizes like 330x415")
+    parser.add_argument("--regions", nargs="+", type=int, default=[DEFAULT_REGION])
+    parser.add_argument("--alpha", type=float, default=10)
+    parser.add_argument("--color-space", choices=("oklab", "rgb"), default="oklab")
+    parser.add_argument("--seed", type=int, default=0, help="base seed, each job derives its own")
+    parser.add_argument("--optimize-path", action="store_true")
+    parser.add_argument("--time-budget", type=float, default=1.0, help="path planner seconds per color")
+    parser.add_argument("--stroke-mode", action="store_true", help="drag same-colored runs instead of dots")
+    parser.add_argument("--color-order", choices=ip.COLOR_ORDERS, default="light-to-dark")
+    parser.add_argument("--max-dots-per-color", type=int, default=None, help="refill pause every N dots")
+    parser.add_argument("--optimize-gcode", action="store_true", help="run the output through gcode_optimizer")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--visualize", action="store_true", help="show each dot matrix when done")
+    parser.add_argument("--render", action="store_true", help="write a PNG preview (dots + toolpath) per job")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes] if args.sizes else [DEFAULT_SIZE]
+    images = find_images(args.inputs)
+    if not images:
+        sys.exit("No images to convert")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    try:
+        jobs = make_jobs(images, sizes, args.regions, args.seed, args.output_dir)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Converting {len(jobs)} jobs on {args.workers} workers...")
+    rows, failures = run_batch(jobs, args.workers, alpha=args.alpha, color_space=args.color_space,
+                               optimize_path=args.optimize_path, time_budget=args.time_budget,
+                               stroke_mode=args.stroke_mode, color_order=args.color_order,
+                               max_dots_per_color=args.max_dots_per_color, optimize_gcode_output=args.optimize_gcode,
+                               keep_dots=args.visualize, render=args.render)
+
+    print()
+    print(format_table(rows))
+
+    if args.visualize:
+        for row in rows:
+            ip.visualize_dot_matrix(row["dot_matrix"], dot_size=5)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import image_processing as ip
+
+IMAGE_SIZES = [(100, 100), (330, 415), (660, 830)]
+REGION_SIZES = [3, 5, 10]
+PALETTE_SIZES = [5, 11]
+SYNTHETIC = ("gradient", "noise")
+
+RESULTS_PATH = "output/benchmark.json"
+BASELINE_PATH = "output/benchmark_baseline.json"
+REGRESSION_RATIO = 1.2  # flag stages that got this much slower than the baseline
+
+
+def make_synthetic_image(kind, size, path, seed=0):
+    """
+    Writes a synthetic test image: a smooth color gradient or uniform noise.
+    """
+    width, height = size
+    if kind == "gradient":
+        x = np.linspace(0, 1, width)[None, :]
+        y = np.linspace(0, 1, height)[:, None]
+        rgb = np.stack([x + 0 * y, y + 0 * x, (1 - x) * (1 - y)], axis=2)
+    else:
+        rgb = np.random.default_rng(seed).random((height, width, 3))
+    Image.fromarray((rgb * 255).astype(np.uint8)).save(path)
+    return path
+
+
+def max_rss_mib():
+    """
+    The process's peak resident set size so far, in MiB (ru_maxrss is KiB on Linux). It's a
+    high-water mark: a stage only moves it by using more than everything before it did.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(fn, *args, repeat=1, **kwargs):
+    """
+    Times fn (fastest of `repeat` runs), then runs it once more under tracemalloc for
+    peak memory so tracing doesn't skew the timing. Returns (result, wall s, peak MiB).
+    The peak only covers the Python heap and NumPy arrays: C libraries such as Pillow
+    allocate out of its sight, so run_case also records the process's peak RSS.
+    """
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def run_case(image_path, output_size, region_size, palette_size, seed=0, repeat=1):
+    """
+    Times every stage of image -> G-code for one parameter set.
+    """
+    palette_ids = sorted(ip.palette)[:palette_size]
+    stages = {}
+
+    color_matrix, t, mem = measure(ip.load_and_process_image, image_path, output_size=output_size, repeat=repeat)
+    stages["load"] = {"wall_s": t, "peak_mib": mem, "max_rss_mib": max_rss_mib()}
+
+    dot_matrix, t, mem = measure(ip.compute_dominant_color_matrix, color_matrix, region_size=region_size,
+                                 seed=seed, palette_ids=palette_ids, repeat=repeat)
+    stages["quantize"] = {"wall_s": t, "peak_mib": mem, "max_rss_mib": max_rss_mib()}
+
+    def generate():
+        # verbose=False: the pass summary would print on every timed run
+        return list(ip.PointillismToolpath(dot_matrix, verbose=False).iter_gcode())
+
+    gcode, t, mem = measure(generate, repeat=repeat)
+    stages["generate"] = {"wall_s": t, "peak_mib": mem, "max_rss_mib": max_rss_mib(), "lines": len(gcode)}
+
+    fd, path = tempfile.mkstemp(suffix=".gcode")
+    os.close(fd)
+    try:
+        lines, t, mem = measure(ip.write_gcode, gcode, path, repeat=repeat)
+    finally:
+        os.unlink(path)
+    stages["write"] = {"wall_s": t, "peak_mib": mem, "max_rss_mib": max_rss_mib(), "lines": lines}
+
+    stages["total"] = {
+        "wall_s": sum(stage["wall_s"] for stage in stages.values()),
+        "peak_mib": max(stage["peak_mib"] for stage in stages.values()),
+        "max_rss_mib": max_rss_mib(),
+        "dots": int(np.count_nonzero(dot_matrix != ip.WHITE)),  # white cells get no dot
+    }
+    return stages
+
+
+def run_matrix(images, image_sizes=IMAGE_SIZES, region_sizes=REGION_SIZES, palette_sizes=PALETTE_SIZES,
+               repeat=1, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = list(images)
+        for kind in SYNTHETIC:
+            sources.append(make_synthetic_image(kind, (800, 800), os.path.join(tmp, f"{kind}.png"), seed))
+
+        for image_path in sources:
+            name = os.path.basename(image_path)
+            for size in image_sizes:
+                for region_size in region_sizes:
+                    for palette_size in palette_sizes:
+                        stages = run_case(image_path, size, region_size, palette_size, seed, repeat)
+                        key = f"{name}|{size[0]}x{size[1]}|r{region_size}|p{palette_size}"
+                        results.append({"case": key, "stages": stages})
+                        print(f"{key:<40} {stages['total']['wall_s'] * 1000:8.1f} ms "
+                              f"{stages['total']['peak_mib']:7.1f} MiB heap "
+                              f"{stages['total']['max_rss_mib']:7.1f} MiB RSS "
+                              f"{stages['generate']['lines']:>7} lines")
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, ratio=REGRESSION_RATIO):
+    """
+    Prints per-stage wall time against the baseline and returns the cases that regressed.
+    """
+    base = {r["case"]: r["stages"] for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = base.get(result["case"])
+        if not old:
+            continue
+        for stage, new in result["stages"].items():
+            if stage not in old or not old[stage]["wall_s"]:
+                continue
+            change = new["wall_s"] / old[stage]["wall_s"]
+            if change > ratio:
+                regressions.append((result["case"], stage, change))
+    totals = [(r["stages"]["total"]["wall_s"], base[r["case"]]["total"]["wall_s"])
+              for r in report["results"] if r["case"] in base]
+    if totals:
+        new_total = sum(t for t, _ in totals)
+        old_total = sum(t for _, t in totals)
+        print(f"\nTotal vs baseline: {new_total:.2f} s vs {old_total:.2f} s ({new_total / old_total:.2f}x)")
+    for case, stage, change in regressions:
+        print(f"  ⚠️ {case} {stage}: {change:.2f}x slower")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image -> G-code pipeline.")
+    parser.add_argument("images", nargs="*", help="images to use (default: everything in images/)")
+    parser.add_argument("--sizes", nargs="+", default=None, help="output sizes like 330x415")
+    parser.add_argument("--regions", nargs="+", type=int, default=REGION_SIZES)
+    parser.add_argument("--palettes", nargs="+", type=int, default=PALETTE_SIZES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    images = args.images or sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(f"images/*.{ext}"))
+    sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes] if args.sizes else IMAGE_SIZES
+
+    report = run_matrix(images, sizes, args.regions, args.palettes, args.repeat, args.seed)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            if compare(report, json.load(f)):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import math
+import sys
+import numpy as np
+
+import image_processing as ip
+from machine_config import LINE_FLOW, drag_feedrate
+
+# Boundaries run along the cell lattice: vertex (r, c) is the corner between cells, so with
+# the generators' 3 mm dot spacing it sits at x = 3 * (c + 0.5), y = -3 * (r + 0.5).
+SPACING = 3.0
+LINE_COLOR = 5  # black
+EPSILON = 0.6  # Douglas-Peucker tolerance in cells; 0.5 already flattens lattice staircases
+ARC_TOLERANCE = 0.25  # max distance of (smoothed) traced points from a fitted arc, in cells
+MAX_ARC_RADIUS = 40  # in cells; flatter than this is a straight line
+MIN_ARC_POINTS = 6
+MAX_ARC_POINTS = 200
+SMOOTHING = 5  # moving-average window over lattice points before fitting arcs
+MIN_LENGTH = 2  # drop specks shorter than this many cells of outline
+
+
+def luminance_levels(color_matrix, region_size=5, levels=4):
+    """
+    Labels each region of a source image (normalized RGB) by its mean luminance, posterized
+    into `levels` bands. Tracing the label boundaries gives tone contours of the image
+    itself rather than of the painted palette.
+    """
+    rows = color_matrix.shape[0] // region_size
+    cols = color_matrix.shape[1] // region_size
+    blocks = color_matrix[:rows * region_size, :cols * region_size]
+    blocks = blocks.reshape(rows, region_size, cols, region_size, -1)
+    rgb = blocks.mean(axis=(1, 3), dtype=np.float32)
+    if color_matrix.dtype == np.uint8:
+        rgb /= 255.0
+    luma = rgb @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    return np.minimum((luma * levels).astype(int), levels - 1)
+
+
+def boundary_edges(labels, color=None, include_border=False):
+    """
+    Unit lattice edges separating differently labelled cells, as (horizontal, vertical)
+    boolean masks of shape (rows + 1, cols) and (rows, cols + 1). With color, only the
+    outline of that label's regions. include_border also traces along the image edge.
+    """
+    padded = np.pad(np.asarray(labels), 1, constant_values=-1)
+    masks = []
+    for a, b in ((padded[:-1, 1:-1], padded[1:, 1:-1]), (padded[1:-1, :-1], padded[1:-1, 1:])):
+        if color is None:
+            edge = a != b
+        else:
+            edge = (a == color) != (b == color)
+        if not include_border:
+            edge &= (a >= 0) & (b >= 0)
+        masks.append(edge)
+    return masks
+
+
+def trace_boundaries(labels, color=None, include_border=False):
+    """
+    Chains boundary edges into polylines of lattice vertices (row, col). Chains stop at
+    junctions and dead ends; what's left after that is closed loops (first == last).
+    """
+    horizontal, vertical = boundary_edges(labels, color, include_border)
+    width = np.asarray(labels).shape[1] + 1  # lattice vertices per row
+
+    adjacency = {}
+    hr, hc = np.nonzero(horizontal)
+    vr, vc = np.nonzero(vertical)
+    starts = np.concatenate((hr * width + hc, vr * width + vc))
+    ends = np.concatenate((hr * width + hc + 1, (vr + 1) * width + vc))
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        adjacency.setdefault(a, []).append(b)
+        adjacency.setdefault(b, []).append(a)
+
+    used = set()
+
+    def walk(start, nxt):
+        chain = [start]
+        prev, cur = start, nxt
+        while True:
+            used.add((min(prev, cur), max(prev, cur)))
+            chain.append(cur)
+            if len(adjacency[cur]) != 2 or cur == start:
+                return chain
+            a, b = adjacency[cur]
+            prev, cur = cur, (b if a == prev else a)
+
+    chains = []
+    # Open chains first, from every junction or dead end, then whatever loops remain
+    for pass_loops in (False, True):
+        for v, neighbors in adjacency.items():
+            if not pass_loops and len(neighbors) == 2:
+                continue
+            for n in neighbors:
+                if (min(v, n), max(v, n)) not in used:
+                    chains.append(walk(v, n))
+    return [[divmod(v, width) for v in chain] for chain in chains]
+
+
+def douglas_peucker(points, epsilon):
+    """
+    Simplifies a polyline (N x 2 array) keeping every point farther than epsilon from
+    the simplified line. Closed polylines keep their closing point.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        inner = points[first + 1:last]
+        ab = b - a
+        norm = math.hypot(*ab)
+        if norm < 1e-12:  # closed loop: measure from the shared end point
+            dist = np.hypot(*(inner - a).T)
+        else:
+            dist = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > epsilon:
+            mid = first + 1 + i
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return points[keep]
+
+
+def smooth(points, window=SMOOTHING):
+    """
+    Moving average that rounds off lattice staircases. Closed polylines wrap around;
+    open ones keep their end points so chains still meet at junctions.
+    """
+    points = np.asarray(points, dtype=float)
+    if window < 2 or len(points) <= window:
+        return points
+    kernel = np.ones(window) / window
+    half = window // 2
+    closed = np.allclose(points[0], points[-1])
+    ring = points[:-1] if closed else points
+    padded = np.pad(ring, ((half, window - 1 - half), (0, 0)), mode="wrap" if closed else "edge")
+    out = np.column_stack([np.convolve(padded[:, k], kernel, mode="valid") for k in range(2)])
+    if closed:
+        return np.vstack((out, out[:1]))
+    out[0], out[-1] = points[0], points[-1]
+    return out
+
+
+def _circle(points):
+    """
+    Least-squares (Kasa) circle through points: (center, radius), or None if degenerate.
+    """
+    x, y = points[:, 0], points[:, 1]
+    a = np.column_stack((x, y, np.ones(len(points))))
+    (d, e, f), *_ = np.linalg.lstsq(a, -(x * x + y * y), rcond=None)
+    center = np.array([-d / 2, -e / 2])
+    r2 = center @ center - f
+    if not np.isfinite(r2) or r2 <= 0:
+        return None
+    return center, math.sqrt(r2)
+
+
+def _snap_center(center, a, b):
+    """
+    Moves a fitted center onto the perpendicular bisector of chord a-b, so both ends are
+    exactly one radius away (GRBL rejects arcs whose end radius doesn't match).
+    """
+    mid = (a + b) / 2
+    chord = b - a
+    normal = np.array([-chord[1], chord[0]])
+    norm2 = normal @ normal
+    if norm2 < 1e-12:
+        return center
+    return mid + normal * ((center - mid) @ normal) / norm2
+
+
+def _arc_fit(points, center, radius, tolerance):
+    """
+    True if points hug the circle and sweep one way around it. Returns (fits, clockwise).
+    """
+    offsets = points - center
+    if np.abs(np.hypot(*offsets.T) - radius).max() > tolerance:
+        return False, False
+    cross = offsets[:-1, 0] * offsets[1:, 1] - offsets[:-1, 1] * offsets[1:, 0]
+    if (cross > 0).all():
+        return True, False
+    if (cross < 0).all():
+        return True, True
+    return False, False
+
+
+def fit_segments(points, epsilon, arcs=False, arc_tolerance=ARC_TOLERANCE, min_arc_points=MIN_ARC_POINTS,
+                 max_radius=None):
+    """
+    Turns a traced polyline into a path: its vertices plus, per segment, None for a straight
+    line or (center, clockwise) for an arc. With arcs the points are smoothed first and
+    spans that fit a circle become arcs; everything else is simplified with Douglas-Peucker.
+    """
+    points = np.asarray(points, dtype=float)
+    if not arcs or len(points) < min_arc_points:
+        simple = douglas_peucker(points, epsilon)
+        return {"points": simple, "arcs": [None] * (len(simple) - 1)}
+    points = smooth(points)
+
+    out_points, out_arcs = [points[0]], []
+    pending = [points[0]]
+
+    def flush():
+        if len(pending) > 1:
+            simple = douglas_peucker(np.array(pending), epsilon)
+            out_points.extend(simple[1:])
+            out_arcs.extend([None] * (len(simple) - 1))
+
+    i, n = 0, len(points)
+    while i < n - 1:
+        best = None
+        j = i + min_arc_points - 1
+        while j < n and j - i < MAX_ARC_POINTS:
+            circle = _circle(points[i:j + 1])
+            if circle is None or (max_radius and circle[1] > max_radius):
+                break
+            fits, clockwise = _arc_fit(points[i:j + 1], circle[0], circle[1], arc_tolerance)
+            if not fits:
+                break
+            best = (j, _snap_center(circle[0], points[i], points[j]), clockwise)
+            j += 1
+        if best:
+            flush()
+            j, center, clockwise = best
+            out_points.append(points[j])
+            out_arcs.append((center, clockwise))
+            pending = [points[j]]
+            i = j
+        else:
+            pending.append(points[i + 1])
+            i += 1
+    flush()
+    return {"points": np.array(out_points), "arcs": out_arcs}
+
+
+def path_length(path):
+    total = 0.0
+    pts = path["points"]
+    for k, arc in enumerate(path["arcs"]):
+        a, b = pts[k], pts[k + 1]
+        if arc is None:
+            total += math.hypot(*(b - a))
+            continue
+        center, clockwise = arc
+        sweep = math.atan2(*(b - center)[::-1]) - math.atan2(*(a - center)[::-1])
+        sweep = (-sweep if clockwise else sweep) % (2 * math.pi)
+        total += sweep * math.hypot(*(a - center))
+    return total
+
+
+def reverse_path(path):
+    arcs = [None if arc is None else (arc[0], not arc[1]) for arc in reversed(path["arcs"])]
+    return {"points": path["points"][::-1], "arcs": arcs}
+
+
+def contour_paths(labels, color=None, spacing=SPACING, epsilon=EPSILON, arcs=False, min_length=MIN_LENGTH,
+                  include_border=False):
+    """
+    Traced, simplified boundary paths of a label matrix in machine coordinates (mm).
+    epsilon, min_length and the arc tolerance are in cells and scale with spacing.
+    """
+    paths = []
+    for chain in trace_boundaries(labels, color, include_border):
+        rc = np.array(chain, dtype=float)
+        xy = np.column_stack((spacing * (rc[:, 1] + 0.5), -spacing * (rc[:, 0] + 0.5)))
+        path = fit_segments(xy, epsilon * spacing, arcs, ARC_TOLERANCE * spacing, max_radius=MAX_ARC_RADIUS * spacing)
+        if path_length(path) >= min_length * spacing:
+            paths.append(path)
+    return paths
+
+
+def order_paths(paths, start=(0.0, 0.0)):
+    """
+    Greedy nearest-end ordering: from the current position go to the closest unpainted
+    path, entering from whichever end is nearer (closed loops start where they close).
+    Distances are Manhattan, since travel is an X move then a Y move.
+    """
+    if not paths:
+        return []
+    heads = np.array([p["points"][0] for p in paths])
+    tails = np.array([p["points"][-1] for p in paths])
+    remaining = np.ones(len(paths), dtype=bool)
+    pos = np.asarray(start, dtype=float)
+    ordered = []
+    for _ in range(len(paths)):
+        d_head = np.abs(heads - pos).sum(axis=1)
+        d_tail = np.abs(tails - pos).sum(axis=1)
+        d = np.where(remaining, np.minimum(d_head, d_tail), np.inf)
+        k = int(np.argmin(d))
+        remaining[k] = False
+        path = paths[k] if d_head[k] <= d_tail[k] else reverse_path(paths[k])
+        ordered.append(path)
+        pos = path["points"][-1]
+    return ordered
+
+
+def _path_gcode(path, z_height, feedrate, stroke_feedrate, spacing, line_flow):
+    pts = path["points"]
+    yield f"G0 X{pts[0][0]:.2f} F{feedrate}"
+    yield f"G0 Y{pts[0][1]:.2f} F{feedrate}"
+    length = path_length(path)
+    cells = max(1, round(length / spacing))
+    volume = length * line_flow
+    yield f"G1 Z{z_height:.2f} F500"  # Move to canvas
+    yield f";STROKE {cells} {volume:.3f}"  # dispense along the whole outline
+    yield f"F{min(stroke_feedrate, drag_feedrate(length, 1, volume)):.2f}"  # as long as the syringe takes
+    pts = np.round(pts, 2)  # what GRBL will actually see
+    for k, arc in enumerate(path["arcs"]):
+        x, y = pts[k + 1]
+        if arc is None:
+            yield f"G1 X{x:.2f} Y{y:.2f}"
+        else:
+            center, clockwise = arc
+            i, j = _snap_center(center, pts[k], pts[k + 1]) - pts[k]
+            yield f"{'G2' if clockwise else 'G3'} X{x:.2f} Y{y:.2f} I{i:.4f} J{j:.4f}"
+    yield "G1 Z3 F500" #retract from canvas
+
+
+def iter_contour_gcode(labels, per_color=False, line_color=LINE_COLOR, feedrate=800, z_height=0,
+                       stroke_feedrate=ip.STROKE_FEEDRATE, spacing=SPACING, epsilon=EPSILON, arcs=False,
+                       min_length=MIN_LENGTH, include_border=False, line_flow=LINE_FLOW, color_order="id",
+                       skip_colors=(ip.WHITE,), verbose=True):
+    """
+    Yields line-art G-code for a label matrix (a dot matrix or luminance_levels output):
+    every boundary as one continuous ;STROKE, ordered to keep travel short. By default
+    all boundaries are drawn in line_color in a single pass; per_color outlines each
+    color's regions in that color, one pass per color actually used (chosen and ordered
+    by ip.plan_color_passes, so white background isn't outlined), with an M0 pause
+    between passes but none after the last.
+    Each outline dispenses line_flow ml per mm (given on its ;STROKE marker) and is fed so
+    it takes as long as the syringe does, at most stroke_feedrate. verbose=False drops the
+    summary printout.
+    """
+    yield "G90" # absolute coords
+    yield "G10 L20 P1 X0 Y0 Z0"
+    yield "G1 Z3 F500"  # retract from canvas
+    yield "G0 X-100 F800"
+    yield "M0 ; Pause to change color"  # Pause for manual color change
+
+    labels = np.asarray(labels)
+    passes = ip.plan_color_passes(labels, color_order, skip_colors) if per_color else [line_color]
+    park = (-100.0, 0.0)
+    total_paths = total_length = 0.0
+
+    first = True
+    for color_index in passes:
+        paths = contour_paths(labels, color_index if per_color else None, spacing, epsilon, arcs, min_length,
+                              include_border)
+        if not paths:
+            continue
+        if not first:
+            yield "M0 ; Pause to change color"  #Pause for manual color change
+        first = False
+        yield f"; --- Starting color: {ip.color_map[color_index]} ---"
+        for path in order_paths(paths, park):
+            yield from _path_gcode(path, z_height, feedrate, stroke_feedrate, spacing, line_flow)
+            total_length += path_length(path)
+        total_paths += len(paths)
+
+        yield "G1 Z5 F1000" #  Raise Z first (safe height)
+        yield "G0 X-100 F800"  # Then rapid move to home position
+        yield "G0 Y0 F800"
+
+    if verbose:
+        print(f"〰️ {int(total_paths)} strokes, {total_length / 1000:.2f} m of line")
+
+
+if __name__ == "__main__":
+    image_path = sys.argv[1] if len(sys.argv) > 1 else "images/THEIMAGE.jpeg"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else "output/contours.gcode"
+    PER_COLOR = False  # outline every color region in its own color instead of one black line
+    ARCS = True  # fit G2/G3 arcs where the outline curves
+
+    _, dot_matrix = ip.load_and_quantize_cached(image_path, output_size=(330, 415), region_size=5, seed=0,
+                                                color_space="oklab")
+    lines = ip.write_gcode(iter_contour_gcode(dot_matrix, per_color=PER_COLOR, arcs=ARCS), output_path)
+    print(f"G-code written to {output_path} ({lines} lines)")
+
+    from gcode_sim import simulate_file, format_report
+    print(format_report(simulate_file(output_path)))
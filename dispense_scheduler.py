@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+
+from machine_config import dispense_duration
+from syringe_stepper import move_motor
+
+
+class DispenseScheduler:
+    """
+    Runs the syringe on a background worker so paint delivery overlaps XY travel.
+
+    The sender streams "G4 P0" after each dot's travel move; GRBL only acknowledges it
+    once the machine has arrived, which is when `arrived` queues the dispense. A
+    following "G4 P<dwell_time>" keeps GRBL from plunging until the syringe is done,
+    while the host keeps feeding the lines after it. A `pre_pressurize` fraction of each
+    dispense can run while the travel move is still executing; on a short hop it may
+    still be running on arrival, with the main share queued behind it, so dwell_time
+    covers both. Dispenses that still outlast the dwell are counted in `overruns`.
+
+    Strokes (";STROKE <cells> [ml]") dispense cells * amount_ml, or the ml given, with no
+    dwell: the syringe starts when the plunge is acknowledged and runs while GRBL drags
+    the nozzle at the matching feed; the sender waits for it before streaming the retract.
+    """
+
+    def __init__(self, amount_ml, pre_pressurize=0.2, dwell_margin=1.1):
+        self.amount_ml = amount_ml
+        self.pre_pressurize = min(max(pre_pressurize, 0.0), 1.0)
+        self.pre_amount = amount_ml * self.pre_pressurize
+        self.main_amount = amount_ml - self.pre_amount
+        self.dwell_time = (dispense_duration(self.pre_amount) + dispense_duration(self.main_amount)) * dwell_margin
+
+        self.latencies = []  # seconds from arrival to dispense complete, per dot
+        self.overruns = 0  # dots whose dispense finished after the dwell let GRBL plunge
+        self._tasks = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                amount, arrived_at, dwell = task
+                if amount > 0:
+                    move_motor(amount)
+                if arrived_at is not None:
+                    latency = time.perf_counter() - arrived_at
+                    self.latencies.append(latency)
+                    if dwell and latency > dwell:
+                        self.overruns += 1
+            finally:
+                self._tasks.task_done()
+
+    def prepressurize(self):
+        """
+        Queues the pre-pressurize share of the next dispense (during travel).
+        """
+        if self.pre_amount > 0:
+            self._tasks.put((self.pre_amount, None, None))
+
+    def arrived(self):
+        """
+        Called when GRBL acknowledges the G4 P0 sync: the machine is over the dot.
+        """
+        self._tasks.put((self.main_amount, time.perf_counter(), self.dwell_time))
+
+    def stroke(self, cells, amount_ml=None):
+        """
+        Called when GRBL acknowledges the sync after a stroke's plunge. amount_ml is the
+        stroke's whole volume when its marker gives one, else cells * amount_ml.
+        """
+        amount = self.amount_ml * cells if amount_ml is None else amount_ml
+        self._tasks.put((amount, time.perf_counter(), None))
+
+    def wait(self):
+        """
+        Blocks until every queued dispense has finished.
+        """
+        self._tasks.join()
+
+    def close(self):
+        self.wait()
+        self._tasks.put(None)
+        self._worker.join()
+
+    def summary(self):
+        if not self.latencies:
+            return "No dispenses recorded"
+        mean = sum(self.latencies) / len(self.latencies)
+        return (f"{len(self.latencies)} dispenses, latency mean {mean * 1000:.1f} ms, "
+                f"max {max(self.latencies) * 1000:.1f} ms, {self.overruns} outlasted the dwell")
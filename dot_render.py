@@ -0,0 +1,155 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import image_processing as ip
+from gcode_sim import parse_gcode, modal_state
+
+CELL_PITCH = 3.0  # mm between dot centers (see image_processing._cell_xy)
+DOT_DIAMETER = 2.4  # mm, about what one DISPENSE_AMOUNT spreads to on paper
+PX_PER_MM = 4
+BACKGROUND = (255, 255, 255)  # the canvas
+TRAVEL_COLOR = (255, 0, 255)  # rapids, a color that isn't in the palette
+STROKE_COLOR = (64, 64, 64)  # feed moves in XY: strokes and contour lines
+CANVAS_Z = 0.5  # feed moves at or below this height are painting
+
+# Palette indices after the paint colors, for the image's own colors
+BACKGROUND_INDEX = len(ip.COLOR_LUT)
+TRAVEL_INDEX = BACKGROUND_INDEX + 1
+STROKE_INDEX = BACKGROUND_INDEX + 2
+
+
+def _disk(cell_px, dot_px):
+    """
+    Boolean mask of one painted dot centered in a cell_px square.
+    """
+    r = (np.arange(cell_px) + 0.5 - cell_px / 2) ** 2
+    return r[:, None] + r[None, :] <= (dot_px / 2) ** 2
+
+
+def render_palette(lut=ip.COLOR_LUT, skip_colors=(ip.WHITE,)):
+    """
+    Flat 256-entry RGB palette: the paint colors (skip_colors as background), then the
+    background, travel and stroke colors.
+    """
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    colors[:len(lut)] = lut
+    colors[list(skip_colors)] = BACKGROUND
+    colors[[BACKGROUND_INDEX, TRAVEL_INDEX, STROKE_INDEX]] = [BACKGROUND, TRAVEL_COLOR, STROKE_COLOR]
+    return colors.ravel().tolist()
+
+
+def render_dot_matrix(dot_matrix, px_per_mm=PX_PER_MM, dot_diameter=DOT_DIAMETER, pitch=CELL_PITCH,
+                      skip_colors=(ip.WHITE,), lut=ip.COLOR_LUT):
+    """
+    Renders a dot matrix as it will come out on paper: one round dot of dot_diameter mm per
+    cell at the machine's pitch, px_per_mm pixels per mm, half a cell of margin around it.
+    Every dot is stamped with the same disk mask through broadcasting, straight into a
+    uint8 palette image whose palette is lut, so there's no per-pixel RGB conversion at
+    all; cells in skip_colors aren't painted, so they stay background.
+    Returns a PIL image in "P" mode.
+    """
+    cell_px = max(1, int(round(pitch * px_per_mm)))
+    pad = cell_px // 2
+    ids = np.asarray(dot_matrix).astype(np.uint8)
+    rows, cols = ids.shape
+    disk = _disk(cell_px, dot_diameter * px_per_mm)
+
+    pixels = np.full((rows * cell_px + 2 * pad, cols * cell_px + 2 * pad), BACKGROUND_INDEX, dtype=np.uint8)
+    tiles = np.where(disk[None, :, None, :], ids[:, None, :, None], np.uint8(BACKGROUND_INDEX))
+    pixels[pad:pad + rows * cell_px, pad:pad + cols * cell_px] = tiles.reshape(rows * cell_px, cols * cell_px)
+    image = Image.fromarray(pixels, "P")
+    image.putpalette(render_palette(lut, skip_colors))
+    return image
+
+
+def draw_toolpath(image, gcode_path, px_per_mm=PX_PER_MM, pitch=CELL_PITCH, travel=True, strokes=True):
+    """
+    Draws the XY moves of a G-code file over a render_dot_matrix image: rapids as thin
+    TRAVEL_COLOR lines, then feed moves on the canvas as thick STROKE_COLOR ones on top
+    (arcs as their chords). Moves off the picture, like trips to the park position, are
+    clipped.
+    """
+    with open(gcode_path, "rb") as f:
+        words = parse_gcode(f.read())
+    motion_mode, is_move, pos, _ = modal_state(words)
+
+    # Only moves that change XY; Z plunges and retracts draw nothing
+    xy = np.concatenate(([[0.0, 0.0]], pos[is_move, :2]))
+    mode = motion_mode[is_move]
+    z = pos[is_move, 2]
+    moved = (np.diff(xy, axis=0) != 0).any(axis=1)
+    kind = np.where(mode == 0, 0, np.where(z <= CANVAS_Z, 1, 2))[moved]  # 0 travel, 1 paint, 2 feed in the air
+    start, end = xy[:-1][moved], xy[1:][moved]
+
+    # Same cell -> pixel mapping as render_dot_matrix: cell centers are pitch mm apart from (pitch, -pitch)
+    cell_px = max(1, int(round(pitch * px_per_mm)))
+    pad = cell_px // 2
+    scale = cell_px / pitch
+    offset = pad + cell_px / 2 - cell_px
+
+    def to_px(points):
+        return np.stack([points[:, 0] * scale + offset, -points[:, 1] * scale + offset], axis=1)
+
+    start, end = to_px(start), to_px(end)
+    draw = ImageDraw.Draw(image)
+    palette = image.mode == "P"
+    layers = []
+    if travel:
+        layers.append(((kind == 0) | (kind == 2), TRAVEL_INDEX if palette else TRAVEL_COLOR, 1))
+    if strokes:
+        layers.append((kind == 1, STROKE_INDEX if palette else STROKE_COLOR, max(1, cell_px // 3)))
+
+    for selected, fill, width in layers:
+        s, e = start[selected], end[selected]
+        # One polyline per run of connected segments
+        breaks = np.flatnonzero((s[1:] != e[:-1]).any(axis=1)) + 1
+        for a, b in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(s)]))):
+            if a < b:
+                points = np.concatenate((s[a:a + 1], e[a:b]))
+                draw.line([tuple(p) for p in points.tolist()], fill=fill, width=width)
+    return image
+
+
+def render_png(dot_matrix, output_path, gcode_path=None, px_per_mm=PX_PER_MM, dot_diameter=DOT_DIAMETER,
+               skip_colors=(ip.WHITE,)):
+    """
+    render_dot_matrix (plus the G-code's toolpath if given) written to a PNG.
+    """
+    image = render_dot_matrix(dot_matrix, px_per_mm, dot_diameter, skip_colors=skip_colors)
+    if gcode_path:
+        draw_toolpath(image, gcode_path, px_per_mm)
+    image.save(output_path, optimize=False)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render an image's dot matrix (and toolpath) to PNG, headless.")
+    parser.add_argument("image", help="source image, quantized like batch_convert does (cached)")
+    parser.add_argument("--gcode", help="draw this G-code file's travel and strokes on top")
+    parser.add_argument("-o", "--output", help="PNG path (default: output/<image>_preview.png)")
+    parser.add_argument("--size", default="330x415", help="image size before quantizing, like 330x415")
+    parser.add_argument("--region", type=int, default=5)
+    parser.add_argument("--alpha", type=float, default=10)
+    parser.add_argument("--color-space", choices=("oklab", "rgb"), default="oklab")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--px-per-mm", type=float, default=PX_PER_MM)
+    parser.add_argument("--dot-diameter", type=float, default=DOT_DIAMETER, help="mm")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.image):
+        sys.exit(f"{args.image} not found")
+    size = tuple(int(v) for v in args.size.split("x"))
+    _, dot_matrix = ip.load_and_quantize_cached(args.image, output_size=size, region_size=args.region,
+                                                alpha=args.alpha, seed=args.seed, color_space=args.color_space)
+    output = args.output or os.path.join("output", os.path.splitext(os.path.basename(args.image))[0] + "_preview.png")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    image = render_png(dot_matrix, output, args.gcode, args.px_per_mm, args.dot_diameter)
+    print(f"Preview written to {output} ({image.width}x{image.height})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import glob
+import os
+import re
+import sys
+
+# Comment lines the sender acts on; everything else after a ; never reaches GRBL
+HOST_MARKERS = (";DISPENSE", ";STROKE")
+_WORDS = re.compile(r"\s*([A-Za-z])\s*([-+]?\d*\.?\d+)")
+_LINE = re.compile(r"(?:\s*[A-Za-z]\s*[-+]?\d*\.?\d+)*\s*")
+
+MOTION = (0, 1, 2, 3)
+POSITION_RESET = (10, 28, 30, 92)  # non-modal codes after which the work position isn't known
+AXES = "XYZ"
+DECIMALS = {"I": 4, "J": 4}  # arc offsets keep GRBL's end radius check happy; everything else 3
+
+
+def format_number(value, decimals=3):
+    """
+    Shortest form GRBL reads back as the same number: 3.00 -> 3, 0.50 -> .5, -0.25 -> -.25.
+    """
+    text = f"{value:.{decimals}f}".rstrip("0").rstrip(".")
+    if text in ("", "-0", "-"):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+class _State:
+    """
+    Modal state as GRBL will see it from the optimized stream (not the source file).
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.feed = None
+        self.pos = dict.fromkeys(AXES)  # None = unknown
+
+
+def optimize_gcode(lines, strip_comments=True):
+    """
+    Streaming filter over G-code lines (absolute G90 programs as our generators emit).
+    Consecutive XY-only G0 moves are merged into one rapid (generators only rapid at safe
+    height), modal G and F words that haven't changed are dropped (F only goes out with
+    the feed move that needs it), moves to where the machine already is are removed and
+    numbers are trimmed. ;DISPENSE/;STROKE markers and M0 pauses are kept where they were.
+    Lines it doesn't understand (G91, $ commands, ...) pass through untouched.
+    """
+    state = _State()
+    prog_mode = 0
+    prog_feed = None
+    pending = {}  # merged rapid not yet written
+    relative = False
+
+    def emit(mode, target, extra=()):
+        words = []
+        if mode != state.mode:
+            words.append(f"G{mode}")
+        changed = [(a, v) for a, v in target.items() if state.pos[a] is None or round(state.pos[a] - v, 3) != 0]
+        if not changed and mode not in (2, 3):
+            return None  # no-op move
+        for axis, value in (target.items() if mode in (2, 3) else changed):
+            words.append(axis + format_number(value))
+        for letter, value in extra:
+            words.append(letter + format_number(value, DECIMALS.get(letter, 3)))
+        if mode != 0 and prog_feed is not None and prog_feed != state.feed:
+            words.append("F" + format_number(prog_feed))
+            state.feed = prog_feed
+        state.mode = mode
+        state.pos.update(target)
+        return "".join(words)
+
+    def flush():
+        nonlocal pending
+        line = emit(0, pending) if pending else None
+        pending = {}
+        return line
+
+    for raw in lines:
+        line = raw.strip()
+        code, _, comment = line.partition(";")
+        code = code.strip()
+
+        if not code:
+            if line.startswith(HOST_MARKERS) or (line and not strip_comments):
+                flushed = flush()
+                if flushed:
+                    yield flushed
+                yield line
+            continue
+
+        if relative or not _LINE.fullmatch(code):
+            flushed = flush()
+            if flushed:
+                yield flushed
+            if re.search(r"G0*90(?!\d)", code):
+                relative = False
+            elif re.search(r"G0*91(?!\d)", code):
+                relative = True
+            state = _State()  # whatever that line did, assume nothing about it
+            yield line if not strip_comments else code
+            continue
+
+        words = [(letter.upper(), float(value)) for letter, value in _WORDS.findall(code)]
+        gcodes = [int(v) for letter, v in words if letter == "G"]
+        others = {}
+        for letter, value in words:
+            if letter != "G":
+                others.setdefault(letter, value)
+
+        motion = [g for g in gcodes if g in MOTION]
+        non_modal = [g for g in gcodes if g not in MOTION]
+        if "M" in others or non_modal or len(others) != sum(1 for l, _ in words if l != "G"):
+            # Pauses, dwells, G90, G10 and friends: keep as they are, in order
+            flushed = flush()
+            if flushed:
+                yield flushed
+            if 91 in gcodes:
+                relative = True
+            if any(g in POSITION_RESET for g in non_modal):
+                state.pos = dict.fromkeys(AXES)
+            yield code
+            continue
+
+        if motion:
+            prog_mode = motion[-1]
+        if "F" in others:
+            prog_feed = others["F"]
+        target = {a: others[a] for a in AXES if a in others}
+        arc = [(k, others[k]) for k in "IJ" if k in others]
+        if not target:
+            continue  # only modal changes: they go out with the next move that needs them
+
+        if prog_mode == 0 and "Z" not in target:
+            pending.update(target)
+            continue
+        flushed = flush()
+        if flushed:
+            yield flushed
+        out = emit(prog_mode, target, arc if prog_mode in (2, 3) else ())
+        if out:
+            yield out
+
+    flushed = flush()
+    if flushed:
+        yield flushed
+
+
+def optimize_file(src_path, dst_path, strip_comments=True):
+    """
+    Optimizes a file in one streaming pass. Returns (lines in, lines out, bytes in, bytes out).
+    """
+    stats = [0, 0, 0, 0]
+
+    def counted(f):
+        for line in f:
+            stats[0] += 1
+            stats[2] += len(line)
+            yield line
+
+    with open(src_path) as src, open(dst_path, "w", buffering=1 << 16) as dst:
+        for line in optimize_gcode(counted(src), strip_comments):
+            dst.write(line + "\n")
+            stats[1] += 1
+            stats[3] += len(line) + 1
+    return tuple(stats)
+
+
+def _reduction(before, after):
+    return 100.0 * (before - after) / before if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink G-code: merge rapids, drop modal repeats and no-ops.")
+    parser.add_argument("paths", nargs="*", help="files to optimize (default: output/*.gcode), - for stdin")
+    parser.add_argument("--in-place", action="store_true", help="overwrite the input instead of writing *_opt.gcode")
+    parser.add_argument("--keep-comments", action="store_true")
+    args = parser.parse_args()
+    strip = not args.keep_comments
+
+    if args.paths == ["-"]:
+        for line in optimize_gcode(sys.stdin, strip):
+            sys.stdout.write(line + "\n")
+        return
+
+    paths = args.paths or sorted(p for p in glob.glob("output/*.gcode") if not p.endswith("_opt.gcode"))
+    for path in paths:
+        dst = path + ".tmp" if args.in_place else os.path.splitext(path)[0] + "_opt.gcode"
+        lines_in, lines_out, bytes_in, bytes_out = optimize_file(path, dst, strip)
+        if args.in_place:
+            os.replace(dst, path)
+            dst = path
+        print(f"{path} -> {dst}: {lines_in} -> {lines_out} lines ({_reduction(lines_in, lines_out):.0f}% fewer), "
+              f"{bytes_in / 1024:.0f} -> {bytes_out / 1024:.0f} KiB ({_reduction(bytes_in, bytes_out):.0f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,31 @@
 import serial
+import mmap
+import os
 import time
 import re
 import sys
 import termios
 import tty
+from collections import deque
+import threading
 from syringe_stepper import move_motor
+from dispense_scheduler import DispenseScheduler
+from machine_config import GRBL_SETUP, DISPENSE_AMOUNT
 
 SERIAL_PORT = "/dev/ttyACM0"  # Use `ls /dev/tty*` to find
 BAUD_RATE = 115200
 DISPENSE_REGEX = re.compile(r"M117\s+DISPENSE\s+(\d+(\.\d+)?)")
+# A Z word ends a stroke's drag: the retract must wait for the syringe
+Z_WORD = re.compile(r"^[^;(]*Z", re.IGNORECASE)
+
+# GRBL's serial RX buffer. Character-counting streaming keeps it full without overflowing.
+RX_BUFFER_SIZE = 128
+# "stream" = character counting, "send-response" = wait for each ok before the next line
+STREAM_MODES = ("stream", "send-response")
+# Longest GRBL may go without acknowledging anything before the sender gives up (s). A
+# full buffer only waits on the motion ahead of it: the longest rapid plus a dot dwell.
+ACK_TIMEOUT = 120.0
 
-#for pointillisim dispensing
-DISPENSE_AMOUNT = 10
-
-'''
-$22=1      ; Enable homing cycle
-$23=3      ; Homing direction mask (Z+, X-, Y-)
-$5=1       ; Limit pins use pull-up resistors
-$21=1      ; Enable hard limits
-
-$100=40.00  ; X steps/mm
-$101=40.00  ; Y steps/mm
-$102=400.00 ; Z steps/mm
-$110=1000   ; X max rate (mm/min)
-$111=1000   ; Y max rate
-$112=500    ; Z max rate
-$130=650    ; X max travel (mm)
-$131=700    ; Y max travel
-$132=50     ; Z max travel
-
-'''
-
-GRBL_SETUP = [
-    "$22=0", "$23=3", "$5=1", "$21=0",
-    "$100=40.00", "$101=40.00", "$102=400.00",
-    "$110=1000", "$111=1000", "$112=500",
-    "$130=650", "$131=700", "$132=50"
-]
 
 def setup_grbl(ser):
     for cmd in GRBL_SETUP:
@@ -97,54 +86,260 @@ def get_key():
     finally:
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
-def send_gcode_file(gcode_path):
+def manual_color_change(ser):
+    """
+    Handles an M0 pause: lets the operator move the syringe, then resumes GRBL.
+    """
+    #ability to move motor
+    print("Move syringe motor to correct location (↑/↓)")
+    while True:
+        key = get_key()
+        if key == '\x1b[A':  # Arrow Up
+            move_motor(1, "up")
+        elif key == '\x1b[B':  # Arrow Down
+            move_motor(1, "down")
+        elif key == 'ENTER':
+            break
+        else:
+            print(f"Unknown key: {repr(key)}")
+
+    #press enter to remake it
+    print("[GCODE] Paused (M0). Type ENTER to continue...")
+    input()
+    ser.write(b'~')  # Resume GRBL
+    ser.flush()
+
+
+class CharacterCountingStreamer:
+    """
+    GRBL character-counting stream: keeps sending while the bytes of unacknowledged
+    lines fit in the RX buffer, and matches every ok/error to the line it answers.
+    Raises TimeoutError if GRBL acknowledges nothing for ack_timeout seconds while lines
+    are waiting (a lost ok would otherwise hang the job forever).
+    """
+
+    def __init__(self, ser, rx_buffer_size=RX_BUFFER_SIZE, ack_timeout=ACK_TIMEOUT):
+        self.ser = ser
+        self.rx_buffer_size = rx_buffer_size
+        self.ack_timeout = ack_timeout
+        self.in_flight = deque()  # (line_number, line, byte count, ack callbacks) awaiting a response
+        self.bytes_in_flight = 0
+        self.acked = 0
+        self.errors = []  # (line_number, line, response)
+
+    def read_response(self):
+        """
+        Reads one GRBL line. Returns True if it acknowledged an in-flight line.
+        """
+        resp = self.ser.readline().decode('utf-8', errors='ignore').strip()
+        if not resp:
+            return False
+        if resp == 'ok' or resp.startswith('error'):
+            if not self.in_flight:
+                # Nothing of ours is waiting: a stray ack after a reconnect, or the reply to
+                # a line sent around the streamer (send_gcode_line, $ commands)
+                print(f"[GRBL] {resp} (no line in flight)")
+                return False
+            line_number, line, nbytes, callbacks = self.in_flight.popleft()
+            self.bytes_in_flight -= nbytes
+            self.acked += 1
+            if resp != 'ok':
+                self.errors.append((line_number, line, resp))
+                print(f"[GRBL] {resp} on line {line_number}: {line}")
+            for callback in callbacks:
+                callback()
+            return True
+        # Status reports, alarms and messages don't consume buffer space
+        print(f"[GRBL] {resp}")
+        return False
+
+    def wait_for_ack(self):
+        """
+        Reads until the oldest in-flight line is acknowledged.
+        """
+        deadline = time.monotonic() + self.ack_timeout
+        while not self.read_response():
+            if time.monotonic() > deadline:
+                line_number, line = self.in_flight[0][:2]
+                raise TimeoutError(f"GRBL sent no ok/error for {self.ack_timeout:g} s, "
+                                   f"waiting on line {line_number}: {line}")
+
+    def send(self, line_number, line, on_ack=None):
+        data = (line + '\n').encode()
+        if len(data) > self.rx_buffer_size:
+            raise ValueError(f"Line {line_number} is longer than the GRBL RX buffer: {line}")
+        while self.bytes_in_flight + len(data) > self.rx_buffer_size:
+            self.wait_for_ack()
+        self.ser.write(data)
+        self.in_flight.append((line_number, line, len(data), [on_ack] if on_ack else []))
+        self.bytes_in_flight += len(data)
+
+    def after_last_ack(self, callback):
+        """
+        Runs callback once the most recently sent line is acknowledged (now if it already was).
+        """
+        if self.in_flight:
+            self.in_flight[-1][3].append(callback)
+        else:
+            callback()
+
+    def drain(self):
+        """
+        Blocks until GRBL has acknowledged every line sent so far. An ok only means the
+        line is in the planner; use sync to know it has run.
+        """
+        while self.in_flight:
+            self.wait_for_ack()
+
+    def sync(self, line_number):
+        """
+        Blocks until GRBL has executed every line sent so far: a G4 P0 is only
+        acknowledged once the motion queued ahead of it has finished.
+        """
+        self.send(line_number, "G4 P0")
+        self.drain()
+
+
+def send_gcode_file(gcode_path, mode="stream", pipelined_dispense=False):
+    """
+    Opens the GRBL serial port and streams a G-code file with stream_gcode_file.
+    """
+    if mode not in STREAM_MODES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {STREAM_MODES})")
+
     with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
         time.sleep(2)
         ser.reset_input_buffer()
+        return stream_gcode_file(ser, gcode_path, mode, pipelined_dispense)
+
+
+def _iter_lines(gcode_path, start_offset=0):
+    """
+    Lines of a G-code file from a byte offset, read through mmap so starting deep inside
+    a large file doesn't read everything before it.
+    """
+    with open(gcode_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.seek(start_offset)
+            for raw in iter(mm.readline, b""):
+                yield raw.decode('utf-8', errors='ignore')
+
+
+def stream_gcode_file(ser, gcode_path, mode="stream", pipelined_dispense=False, start_offset=0, start_line=1,
+                      on_sync=None, on_pause=manual_color_change):
+    """
+    Streams a G-code file to GRBL over an open port. mode="stream" uses character counting
+    to keep the RX buffer full; mode="send-response" waits for each reply before the next
+    line. Both modes collect error: responses (printed as they arrive, returned at the end)
+    and raise TimeoutError if an acknowledgement never comes. M0 pauses are handled on the
+    host once GRBL has caught up. When streaming with pipelined_dispense, ;DISPENSE runs
+    on a DispenseScheduler synced by G4 P0 instead of stopping the stream; it is off by
+    default until its dwell timing has been checked on the machine.
+
+    Without pipelined_dispense every dot waits on a G4 P0 (GRBL has run everything before
+    it) before the syringe moves, so character counting only pays off for stroke and
+    contour files (long runs of motion between markers); dot files run about as fast as
+    in send-response mode.
+
+    A ";STROKE <cells> [ml]" starts the syringe once the plunge before it is done (for
+    cells * DISPENSE_AMOUNT, or ml if the marker gives a volume) and streams
+    the drag while it runs (the generators feed the drag at machine_config.drag_feedrate
+    so both take as long); the line with the next Z word, the retract, is held until both
+    the drag and the syringe have finished.
 
-        with open(gcode_path, 'r') as f:
-            for line in f:
-                if line.startswith('M0'):
-                    #ability to move motor
-                    print("Move syringe motor to correct location (↑/↓)")
-                    while True:
-                        key = get_key()
-                        if key == '\x1b[A':  # Arrow Up
-                            move_motor(1, "up")
-                        elif key == '\x1b[B':  # Arrow Down
-                            move_motor(1, "down")
-                        elif key == 'ENTER':
-                            break
-                        else:
-                            print(f"Unknown key: {repr(key)}")
-
-                    #press enter to remake it
-                    print("[GCODE] Paused (M0). Type ENTER to continue...")
-                    input()
-                    ser.write(b'~')  # Resume GRBL
-                    ser.flush()
-                    continue
-                if line.startswith(';DISPENSE'):
-                    move_motor(DISPENSE_AMOUNT)
-                    continue
-
-                line = line.strip()
-                if not line or line.startswith(';'):
-                    continue
-
-                #print(f">> Sending: {line}")
-                ser.write((line + '\n').encode())
-
-
-                #Wait for GRBL response
-                resp = ser.readline().decode().strip()
-                if resp:
-                    print(f"[GRBL] {resp}")
+    start_offset/start_line start partway through the file (see job_resume). on_sync is
+    called with a line number whenever GRBL is known to have executed everything before
+    that line: at every dot's G4 P0 sync and at every M0. on_pause(ser) handles each M0
+    and must resume GRBL; the default asks on the terminal, a GUI passes its own.
+    """
+    def synced(line_number):
+        if on_sync:
+            on_sync(line_number)
+
+    if mode not in STREAM_MODES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {STREAM_MODES})")
+
+    streamer = CharacterCountingStreamer(ser)
+    dispenser = None
+    if mode == "stream" and pipelined_dispense:
+        dispenser = DispenseScheduler(DISPENSE_AMOUNT)
+    stroke_wait = None  # blocks until the syringe of the stroke being dragged is done
+
+    def finish_stroke():
+        nonlocal stroke_wait
+        if stroke_wait:
+            streamer.drain()  # the stroke's sync is in, so its syringe move has been started
+            stroke_wait()
+            stroke_wait = None
+
+    for line_number, line in enumerate(_iter_lines(gcode_path, start_offset), start=start_line):
+        if line.startswith(('M0', ';DISPENSE', ';STROKE')) or Z_WORD.match(line):
+            finish_stroke()
+        if line.startswith('M0'):
+            streamer.sync(line_number)
+            if dispenser:
+                dispenser.wait()
+            synced(line_number)
+            on_pause(ser)
+            continue
+        if line.startswith(';DISPENSE'):
+            if dispenser:
+                # Pre-pressurize once the travel move is queued, dispense on arrival
+                streamer.after_last_ack(dispenser.prepressurize)
+                streamer.send(line_number, "G4 P0",
+                              on_ack=lambda n=line_number: (dispenser.arrived(), synced(n)))
+                streamer.send(line_number, f"G4 P{dispenser.dwell_time:.3f}")
+                continue
+            # Only dispense (and checkpoint the dot) once the machine has arrived over it
+            streamer.sync(line_number)
+            synced(line_number)
+            move_motor(DISPENSE_AMOUNT)
+            continue
+        if line.startswith(';STROKE'):
+            fields = line.split()
+            cells = int(fields[1])
+            # Contour strokes give their own volume, dot strokes a dose per cell
+            amount = float(fields[2]) if len(fields) > 2 else DISPENSE_AMOUNT * cells
+            if dispenser:
+                # Start the syringe once the plunge is done; the drag streams right behind
+                streamer.send(line_number, "G4 P0",
+                              on_ack=lambda cells=cells, amount=amount, n=line_number: (
+                                  dispenser.stroke(cells, amount), synced(n)))
+                stroke_wait = dispenser.wait
+                continue
+            streamer.sync(line_number)  # the plunge has finished, not just been planned
+            synced(line_number)
+            syringe = threading.Thread(target=move_motor, args=(amount,), daemon=True)
+            syringe.start()
+            stroke_wait = syringe.join
+            continue
+
+        line = line.strip()
+        if not line or line.startswith(';'):
+            continue
+
+        streamer.send(line_number, line)
+        if mode == "send-response":
+            streamer.drain()  # Wait for GRBL response
+
+    finish_stroke()
+    streamer.drain()
+    if dispenser:
+        dispenser.close()
+        print(f"[DISPENSE] {dispenser.summary()}")
+    if streamer.errors:
+        print(f"[GCODE] {len(streamer.errors)} line(s) returned errors")
+    return streamer.errors
 
 
 if __name__ == "__main__":
     testing_sender = False
     sending_file = True
+    streaming_mode = "stream"  # "send-response" to wait for each ok
+    resumable = True  # checkpoint progress and pick up after the last confirmed dot (job_resume.py)
+    pipelined_dispense = False  # overlap the syringe with travel (dispense_scheduler.py), opt-in
 
     if testing_sender:
         with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
@@ -157,4 +352,8 @@ if __name__ == "__main__":
 
     if sending_file:
         file_name = 'pointillism.gcode'
-        send_gcode_file(file_name)
\ No newline at end of file
+        if resumable:
+            from job_resume import send_resumable
+            send_resumable(file_name, mode=streaming_mode, pipelined_dispense=pipelined_dispense)
+        else:
+            send_gcode_file(file_name, mode=streaming_mode, pipelined_dispense=pipelined_dispense)
\ No newline at end of file
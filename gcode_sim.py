@@ -0,0 +1,335 @@
+import re
+import sys
+import numpy as np
+
+from machine_config import GRBL_SETUP, DISPENSE_AMOUNT, dispense_duration
+
+# GRBL defaults for settings GRBL_SETUP doesn't override
+GRBL_DEFAULTS = {
+    11: 0.010,                          # junction deviation (mm)
+    110: 500.0, 111: 500.0, 112: 500.0,  # max rate (mm/min)
+    120: 10.0, 121: 10.0, 122: 10.0,     # acceleration (mm/s^2)
+    130: 200.0, 131: 200.0, 132: 200.0,  # max travel (mm)
+}
+
+# A single findall over the whole (comment-stripped) file picks out every word, with or
+# without spaces between words. Newlines match too (as empty tokens) so a cumulative count
+# of them gives each word's line number.
+WORD_LETTERS = "GMXYZFPIJ"
+_WORDS = re.compile(rb"\n|(?<![A-Za-z])([" + WORD_LETTERS.encode() + rb"]-?\d*\.?\d+)")
+_COMMENT = re.compile(rb";[^\n]*")
+_DISPENSE = re.compile(rb"(?m)^;DISPENSE")
+_STROKE = re.compile(rb"(?m)^;STROKE (\d+)(?:[ \t]+(\d*\.?\d+))?")
+
+
+def grbl_settings(setup=GRBL_SETUP):
+    """
+    GRBL $ settings as {number: value}, from a list like ["$110=1000", ...] over the defaults.
+    """
+    settings = dict(GRBL_DEFAULTS)
+    for cmd in setup:
+        key, _, value = cmd.lstrip("$").partition("=")
+        settings[int(key)] = float(value)
+    return settings
+
+
+def _word_columns(data, n_lines):
+    """
+    {letter: value of the first such word on every line (NaN where absent)}.
+    """
+    tokens = _WORDS.findall(data) or [b""]
+    values = np.array([t[1:] for t in tokens])
+    letters = np.array(tokens).view(np.uint8).reshape(len(tokens), -1)[:, 0]
+    lines = np.cumsum(letters == 0)
+
+    columns = {}
+    for letter in WORD_LETTERS:
+        column = np.full(n_lines, np.nan)
+        mask = letters == ord(letter)
+        # Assign in reverse so the first word on a line wins
+        column[lines[mask][::-1]] = values[mask][::-1].astype(float)
+        columns[letter] = column
+    return columns
+
+
+def _forward_fill(values, initial):
+    """
+    Carries the last non-NaN value forward (modal words), starting from initial.
+    """
+    idx = np.where(np.isnan(values), 0, np.arange(1, len(values) + 1))
+    np.maximum.accumulate(idx, out=idx)
+    return np.concatenate(([initial], values))[idx]
+
+
+def parse_gcode(data):
+    """
+    Parses an absolute-coordinate (G90) program as emitted by our generators (str, bytes
+    or any buffer such as an mmap).
+    Returns per-line arrays: G, M, X, Y, Z, F, P, I, J word values, a dispense marker mask,
+    the cell count of every ;STROKE marker line (0 elsewhere) and the volume a marker
+    gives, if any (NaN elsewhere).
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    line_starts = np.concatenate(([0], newlines + 1))
+    if len(data) and data[-1:] == b"\n":
+        line_starts = line_starts[:-1]
+
+    dispense = np.zeros(len(line_starts), dtype=bool)
+    offsets = [m.start() for m in _DISPENSE.finditer(data)]
+    if offsets:
+        dispense[np.searchsorted(line_starts, offsets)] = True
+    stroke = np.zeros(len(line_starts), dtype=np.int64)
+    stroke_ml = np.full(len(line_starts), np.nan)
+    markers = [(m.start(), int(m.group(1)), float(m.group(2) or "nan")) for m in _STROKE.finditer(data)]
+    if markers:
+        offsets, cells, volumes = zip(*markers)
+        at = np.searchsorted(line_starts, offsets)
+        stroke[at] = cells
+        stroke_ml[at] = volumes
+
+    # Comments are blanked in place so line offsets stay valid
+    code = _COMMENT.sub(lambda m: b" " * len(m.group(0)), data)
+    words = _word_columns(code, len(line_starts))
+    words["dispense"] = dispense
+    words["stroke"] = stroke
+    words["stroke_ml"] = stroke_ml
+    return words
+
+
+def modal_state(words, start=(0.0, 0.0, 0.0)):
+    """
+    Program state after every line: (motion mode, is-move mask, X/Y/Z position, feed mm/min).
+    start is the position before the first line.
+    """
+    g = words["G"]
+    axes = np.stack([words["X"], words["Y"], words["Z"]], axis=1)
+
+    # Motion lines: an axis word under G0-G3 (G10, G4 etc. carry axis words but don't move)
+    motion = (g == 0) | (g == 1) | (g == 2) | (g == 3)
+    motion_mode = _forward_fill(np.where(motion, g, np.nan), 0.0)
+    has_axis = ~np.isnan(axes).all(axis=1)
+    non_modal = ~np.isnan(g) & ~motion & (g != 90)
+    is_move = has_axis & ~non_modal
+
+    targets = np.where(is_move[:, None], axes, np.nan)
+    pos = np.stack([_forward_fill(targets[:, k], float(start[k])) for k in range(3)], axis=1)
+    feed = _forward_fill(words["F"], 0.0)
+    return motion_mode, is_move, pos, feed
+
+
+def _junction_speeds(unit, accel, nominal, deviation):
+    """
+    GRBL's junction deviation limit for the corner between consecutive moves (mm/s).
+    """
+    n = len(unit)
+    v_junction = np.zeros(n + 1)  # entry speed of each move, plus exit of the last
+    if n < 2:
+        return v_junction
+    cos_theta = -np.einsum("ij,ij->i", unit[:-1], unit[1:])
+    sin_half = np.sqrt(np.clip(0.5 * (1.0 - cos_theta), 0.0, 1.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        v2 = np.minimum(accel[:-1], accel[1:]) * deviation * sin_half / (1.0 - sin_half)
+    v = np.sqrt(np.where(np.isfinite(v2), v2, np.inf))
+    v = np.minimum(v, np.minimum(nominal[:-1], nominal[1:]))
+    v[cos_theta > 0.999999] = 0.0  # full reversal
+    v_junction[1:-1] = v
+    return v_junction
+
+
+def _plan_speeds(v_junction, accel, length):
+    """
+    GRBL-style backward then forward pass so no move needs more accel than it has.
+    """
+    v = v_junction.tolist()
+    reach = (2.0 * accel * length).tolist()
+    for i in range(len(reach) - 1, -1, -1):
+        limit = v[i + 1] ** 2 + reach[i]
+        if v[i] ** 2 > limit:
+            v[i] = limit ** 0.5
+    for i in range(len(reach)):
+        limit = v[i] ** 2 + reach[i]
+        if v[i + 1] ** 2 > limit:
+            v[i + 1] = limit ** 0.5
+    return np.array(v)
+
+
+def _trapezoid_times(length, v0, v1, vn, accel):
+    """
+    Time for each move: accelerate from v0 towards vn, cruise, decelerate to v1.
+    """
+    d_acc = (vn ** 2 - v0 ** 2) / (2 * accel)
+    d_dec = (vn ** 2 - v1 ** 2) / (2 * accel)
+    cruise = length - d_acc - d_dec
+    trapezoid = (vn - v0) / accel + (vn - v1) / accel + np.maximum(cruise, 0) / vn
+    peak = np.sqrt(np.maximum((2 * accel * length + v0 ** 2 + v1 ** 2) / 2, 0))
+    triangle = (peak - v0) / accel + (peak - v1) / accel
+    return np.where(cruise >= 0, trapezoid, triangle)
+
+
+def simulate(data, settings=None, dispense_time=None, bounds=None, start=(0.0, 0.0, 0.0)):
+    """
+    Estimates how long GRBL will take to run a program (str/bytes G-code).
+    Motion follows GRBL's max rates, per-axis acceleration and junction deviation;
+    each ;DISPENSE adds dispense_time (default: one DISPENSE_AMOUNT move of the syringe).
+    A ";STROKE <cells> [ml]" syringe move (cells * DISPENSE_AMOUNT, or ml, in one go;
+    scaled from dispense_time if that is given) runs during the drag after it, so it only
+    adds whatever it outlasts the drag by: the sender holds the retract for it.
+    bounds is ((xmin, xmax), (ymin, ymax), (zmin, zmax)) in work coordinates, defaulting
+    to +/- the $130-$132 max travel. M0 pauses are counted, not timed. start is where the
+    machine is (at rest) before the first line, for timing a piece of a program.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    settings = settings or grbl_settings()
+    syringe_time = dispense_time is None  # strokes then time their whole move, ramps and all
+    if dispense_time is None:
+        dispense_time = dispense_duration(DISPENSE_AMOUNT)
+    max_rate = np.array([settings[110], settings[111], settings[112]]) / 60.0  # mm/s
+    axis_accel = np.array([settings[120], settings[121], settings[122]])
+    max_travel = np.array([settings[130], settings[131], settings[132]])
+    if bounds is None:
+        bounds = tuple((-t, t) for t in max_travel)
+    lo = np.array([b[0] for b in bounds])
+    hi = np.array([b[1] for b in bounds])
+
+    words = parse_gcode(data)
+    g, m = words["G"], words["M"]
+    motion_mode, is_move, pos, feed = modal_state(words, start)
+    feed = feed / 60.0  # mm/s
+
+    move_lines = np.flatnonzero(is_move)
+    if len(move_lines):
+        begin = np.vstack((np.array([start], dtype=float), pos[move_lines[:-1]]))
+    else:
+        begin = np.zeros((0, 3))
+    end = pos[move_lines]
+    delta = end - begin
+    chord = np.linalg.norm(delta, axis=1)
+    length = chord.copy()
+
+    # G2/G3 (XY plane, I/J center offsets): path length along the arc, plus any Z
+    arc = np.isin(motion_mode[move_lines], (2, 3))
+    if arc.any():
+        offset = np.stack([words["I"][move_lines[arc]], words["J"][move_lines[arc]]], axis=1)
+        offset = np.nan_to_num(offset)
+        center = begin[arc, :2] + offset
+        a0 = np.arctan2(-offset[:, 1], -offset[:, 0])
+        a1 = np.arctan2(end[arc, 1] - center[:, 1], end[arc, 0] - center[:, 0])
+        clockwise = motion_mode[move_lines[arc]] == 2
+        sweep = np.where(clockwise, a0 - a1, a1 - a0) % (2 * np.pi)
+        sweep[sweep < 1e-9] = 2 * np.pi  # same start and end: a full circle
+        length[arc] = np.hypot(sweep * np.hypot(offset[:, 0], offset[:, 1]), delta[arc, 2])
+
+    moving = length > 1e-9
+    move_lines, delta, length, end = move_lines[moving], delta[moving], length[moving], end[moving]
+    chord = chord[moving]
+
+    # Arcs use their chord direction for rate limits and junctions, close enough for short arcs
+    unit = np.where(chord[:, None] > 1e-9, delta / np.maximum(chord, 1e-9)[:, None], [1.0, 0.0, 0.0])
+    abs_unit = np.abs(unit)
+    with np.errstate(divide="ignore"):
+        rate_limit = np.min(np.where(abs_unit > 0, max_rate / abs_unit, np.inf), axis=1)
+        accel = np.min(np.where(abs_unit > 0, axis_accel / abs_unit, np.inf), axis=1)
+    rapid = motion_mode[move_lines] == 0
+    requested = np.where(rapid, np.inf, feed[move_lines])
+    requested = np.where(requested > 0, requested, rate_limit)
+    nominal = np.minimum(requested, rate_limit)
+
+    v_junction = _junction_speeds(unit, accel, nominal, settings[11])
+    v = _plan_speeds(v_junction, accel, length)
+    times = _trapezoid_times(length, v[:-1], v[1:], nominal, accel)
+
+    z_only = abs_unit[:, 2] > 1 - 1e-9
+    plunges = int(np.count_nonzero(z_only & (delta[:, 2] < 0)))
+    out_of_bounds = np.flatnonzero(((end < lo) | (end > hi)).any(axis=1))
+    if len(move_lines):
+        span = pos[move_lines].max(axis=0) - np.minimum(pos[move_lines].min(axis=0), 0)
+    else:
+        span = np.zeros(3)
+
+    # A stroke's drag is every move from its marker to the next one touching Z (the retract)
+    stroke_lines = np.flatnonzero(words["stroke"])
+    stroke_cells = words["stroke"][stroke_lines]
+    z_moves = np.flatnonzero(delta[:, 2] != 0)
+    first = np.searchsorted(move_lines, stroke_lines)
+    last = np.append(z_moves, len(move_lines))[np.searchsorted(z_moves, first)]
+    elapsed = np.concatenate(([0.0], np.cumsum(times)))
+    drag = elapsed[last] - elapsed[first]
+    dragging = np.zeros(len(move_lines) + 1, dtype=np.int64)
+    np.add.at(dragging, first, 1)
+    np.add.at(dragging, last, -1)
+    dragging = np.cumsum(dragging[:-1]) > 0
+    stroke_ml = words["stroke_ml"][stroke_lines]
+    stroke_ml = np.where(np.isnan(stroke_ml), stroke_cells * DISPENSE_AMOUNT, stroke_ml)
+    if syringe_time:
+        durations = {ml: dispense_duration(ml) for ml in set(stroke_ml.tolist())}
+        syringe = np.array([durations[ml] for ml in stroke_ml.tolist()])
+    else:
+        syringe = stroke_ml / DISPENSE_AMOUNT * dispense_time
+    stroke_wait = float(np.maximum(syringe - drag, 0).sum())
+
+    dwell = np.nansum(np.where(g == 4, words["P"], np.nan))
+    dots = int(np.count_nonzero(words["dispense"]))
+    travel_time = float(times[~z_only & ~dragging].sum())
+    drag_time = float(times[dragging].sum())
+    z_time = float(times[z_only].sum())
+    dispense_total = dots * dispense_time + stroke_wait + float(dwell)
+
+    return {
+        "lines": len(g),
+        "moves": int(len(move_lines)),
+        "total_time": travel_time + drag_time + z_time + dispense_total,
+        "travel_time": travel_time,
+        "paint_time": drag_time + z_time + dispense_total,
+        "drag_time": drag_time,
+        "z_time": z_time,
+        "dispense_time": dispense_total,
+        "stroke_wait": stroke_wait,
+        "travel_distance": float(length[~z_only & ~dragging].sum()),
+        "dots": dots,
+        "strokes": len(stroke_cells),
+        "stroke_cells": int(stroke_cells.sum()),
+        "z_plunges": plunges,
+        "color_changes": int(np.count_nonzero(m == 0)),
+        "out_of_bounds": (move_lines[out_of_bounds] + 1).tolist(),  # 1-based line numbers
+        "exceeds_travel": bool((span > max_travel).any()),
+    }
+
+
+def simulate_file(gcode_path, **kwargs):
+    with open(gcode_path, "rb") as f:
+        return simulate(f.read(), **kwargs)
+
+
+def format_duration(seconds):
+    """
+    Seconds as "1h 02m 03s".
+    """
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m {seconds % 60:02d}s"
+
+
+def format_report(report):
+    lines = [
+        f"Estimated runtime: {format_duration(report['total_time'])}",
+        f"  Travel:   {format_duration(report['travel_time'])} ({report['travel_distance'] / 1000:.2f} m XY)",
+        f"  Painting: {format_duration(report['paint_time'])} (Z {format_duration(report['z_time'])}, "
+        f"drag {format_duration(report['drag_time'])}, dispense {format_duration(report['dispense_time'])}, "
+        f"of which {format_duration(report['stroke_wait'])} waiting on stroke syringes)",
+        f"  {report['dots']} dots, {report['strokes']} strokes ({report['stroke_cells']} cells), "
+        f"{report['z_plunges']} Z plunges, "
+        f"{report['color_changes']} color changes (M0), {report['lines']} lines",
+    ]
+    if report["out_of_bounds"]:
+        first = ", ".join(str(n) for n in report["out_of_bounds"][:5])
+        lines.append(f"  ⚠️ {len(report['out_of_bounds'])} moves out of bounds (lines {first}...)")
+    if report["exceeds_travel"]:
+        lines.append("  ⚠️ Job spans more than the machine's max travel")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    gcode_path = sys.argv[1] if len(sys.argv) > 1 else "output/pointillism.gcode"
+    print(format_report(simulate_file(gcode_path)))
@@ -0,0 +1,427 @@
+import contextlib
+import io
+import math
+import os
+import re
+import select
+import sys
+import tempfile
+import threading
+import time
+import tty
+from collections import deque
+
+from gcode_sim import grbl_settings
+
+# Real-time commands GRBL picks out of the byte stream before it reaches the RX buffer
+STATUS_QUERY = ord('?')
+FEED_HOLD = ord('!')
+CYCLE_START = ord('~')
+SOFT_RESET = 0x18
+JOG_CANCEL = 0x85
+REALTIME_BYTES = {STATUS_QUERY, FEED_HOLD, CYCLE_START, SOFT_RESET, JOG_CANCEL}
+
+BANNER = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+_WORD = re.compile(r"([A-Z])(-?\d*\.?\d+)")
+
+
+def block_duration(distance, feed, accel):
+    """
+    Time (s) for a block that starts and ends at rest: trapezoid or triangle profile.
+    feed in mm/s, accel in mm/s^2.
+    """
+    if distance <= 0:
+        return 0.0
+    ramp = feed * feed / accel
+    if distance >= ramp:
+        return distance / feed + feed / accel
+    return 2.0 * math.sqrt(distance / accel)
+
+
+class GrblEmulator:
+    """
+    A GRBL 1.1 stand-in behind a pseudo-terminal, so gcode_sender and jog can run
+    against it unchanged by pointing SERIAL_PORT at `port`.
+
+    Models the RX buffer (bytes past rx_buffer_size are dropped and counted, like the
+    real serial ISR), a planner queue of planner_blocks moves (lines are only acknowledged
+    once their block fits), ok/error replies, '?' status reports, real-time bytes
+    (!, ~, 0x18, 0x85) and per-move execution time from the GRBL settings, scaled by
+    time_scale (0 = instant). Each block starts and ends at rest, which is pessimistic for
+    long collinear runs but close for our dot moves. Incoming bytes are paced at `baud`
+    to mimic the USB link.
+    """
+
+    def __init__(self, rx_buffer_size=128, planner_blocks=15, settings=None, time_scale=1.0,
+                 baud=115200, link_path=None):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.settings = settings or grbl_settings()
+        self.time_scale = time_scale
+        self.baud = baud
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.link_path = link_path
+        if link_path:
+            if os.path.islink(link_path):
+                os.unlink(link_path)
+            os.symlink(self.port, link_path)
+
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.threads = []
+        self._reset_state()
+
+        self.stats = {
+            "lines": 0, "errors": 0, "rx_overflows": 0, "max_rx_bytes": 0,
+            "max_planner_blocks": 0, "blocks": 0, "status_reports": 0,
+            "busy_s": 0.0, "starved_s": 0.0,
+        }
+
+    def _reset_state(self):
+        self.rx = bytearray()
+        self.planner = deque()  # (start, end, duration, is_jog)
+        self.position = [0.0, 0.0, 0.0]   # machine position of the last planned block
+        self.executed = [0.0, 0.0, 0.0]   # machine position reached by the executor
+        self.wco = [0.0, 0.0, 0.0]
+        self.absolute = True
+        self.motion = 0
+        self.feed = 0.0
+        self.held = False
+        self.current = None  # (block, started_at) being executed
+        self.abort_block = False
+        self.abort_position = None
+        self.last_block_end = None
+
+    # --- lifecycle ---
+    def start(self):
+        self.running = True
+        for target in (self._reader, self._parser, self._executor):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self._write(BANNER)
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        os.close(self.master)
+        os.close(self.slave)
+        if self.link_path and os.path.islink(self.link_path):
+            os.unlink(self.link_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _write(self, data):
+        with self.write_lock:
+            os.write(self.master, data)
+
+    # --- serial side ---
+    def _reader(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 256)
+            except OSError:
+                return
+            if self.baud:
+                time.sleep(len(data) * 10.0 / self.baud)
+            with self.cond:
+                for byte in data:
+                    if byte in REALTIME_BYTES:
+                        self._realtime(byte)
+                    elif len(self.rx) < self.rx_buffer_size:
+                        self.rx.append(byte)
+                    else:
+                        self.stats["rx_overflows"] += 1
+                self.stats["max_rx_bytes"] = max(self.stats["max_rx_bytes"], len(self.rx))
+                self.cond.notify_all()
+
+    def _realtime(self, byte):
+        if byte == STATUS_QUERY:
+            self.stats["status_reports"] += 1
+            self._write(self.status_report().encode() + b"\r\n")
+        elif byte == FEED_HOLD:
+            self.held = True
+        elif byte == CYCLE_START:
+            self.held = False
+        elif byte == JOG_CANCEL:
+            if self.current and self.current[0][3]:
+                self.abort_block = True
+                self.abort_position = self.current_position()
+            self.planner = deque(b for b in self.planner if not b[3])
+            if not self.planner:
+                self.position = self.current_position()
+        elif byte == SOFT_RESET:
+            running_block = self.current is not None
+            self._reset_state()
+            self.abort_block = running_block
+            self._write(BANNER)
+
+    def state(self):
+        if self.held:
+            return "Hold:0"
+        block = self.current[0] if self.current else (self.planner[0] if self.planner else None)
+        if block is None:
+            return "Idle"
+        return "Jog" if block[3] else "Run"
+
+    def current_position(self):
+        """
+        Machine position, interpolated along the block being executed.
+        """
+        if not self.current:
+            return list(self.executed)
+        (start, end, duration, _), started = self.current
+        frac = min((time.monotonic() - started) / duration, 1.0) if duration else 1.0
+        return [s + (e - s) * frac for s, e in zip(start, end)]
+
+    def status_report(self):
+        mpos = ",".join(f"{p:.3f}" for p in self.current_position())
+        return f"<{self.state()}|MPos:{mpos}|FS:{self.feed * 60:.0f},0|WCO:" + \
+            ",".join(f"{w:.3f}" for w in self.wco) + ">"
+
+    # --- line parser (GRBL's protocol loop) ---
+    def _parser(self):
+        while self.running:
+            with self.cond:
+                while self.running and b"\n" not in self.rx:
+                    self.cond.wait(0.05)
+                if not self.running:
+                    return
+                end = self.rx.index(b"\n")
+                line = bytes(self.rx[:end]).decode("ascii", errors="ignore")
+                line = line.split(";")[0].strip().upper()
+                del self.rx[:end + 1]
+            self.stats["lines"] += 1
+            resp = self._execute_line(line)
+            if resp.startswith("error"):
+                self.stats["errors"] += 1
+            self._write(resp.encode() + b"\r\n")
+
+    def _wait_for_idle(self):
+        with self.cond:
+            while self.running and (self.planner or self.current):
+                self.cond.wait(0.01)
+
+    def _execute_line(self, line):
+        if not line:
+            return "ok"
+        if line.startswith("$J="):
+            return self._motion_line(line[3:], jog=True)
+        if line.startswith("$"):
+            if "=" in line:
+                key, _, value = line[1:].partition("=")
+                try:
+                    self.settings[int(key)] = float(value)
+                except ValueError:
+                    return "error:3"
+            elif line == "$H":
+                self._wait_for_idle()
+                self.position = [0.0, 0.0, 0.0]
+                self.executed = [0.0, 0.0, 0.0]
+            elif line == "$$":
+                for key in sorted(self.settings):
+                    self._write(f"${key}={self.settings[key]:.3f}\r\n".encode())
+            return "ok"
+        return self._motion_line(line)
+
+    def _motion_line(self, line, jog=False):
+        words = {}
+        gcodes = []
+        for letter, value in _WORD.findall(line):
+            if letter == "G":
+                gcodes.append(float(value))
+            else:
+                words[letter] = float(value)
+        absolute = self.absolute
+        non_modal = None
+        for g in gcodes:
+            if g in (0, 1, 2, 3):
+                if not jog:
+                    self.motion = int(g)
+            elif g == 90:
+                absolute = True
+            elif g == 91:
+                absolute = False
+            elif g in (4, 10):
+                non_modal = g
+            elif g not in (17, 21, 94):
+                return "error:20"
+        if not jog:
+            self.absolute = absolute
+        if "F" in words:
+            self.feed = words["F"] / 60.0
+
+        if words.get("M") in (0, 2, 30):
+            self._wait_for_idle()
+            if words["M"] == 0:
+                self.held = True
+            return "ok"
+        if non_modal == 4:
+            self._wait_for_idle()
+            time.sleep(words.get("P", 0.0) * self.time_scale)
+            return "ok"
+        if non_modal == 10:
+            # G10 L20 P1: make the current position read as the given work coordinates;
+            # G10 L2 P1: set the work offset itself (in machine coordinates)
+            for k, axis in enumerate("XYZ"):
+                if axis in words:
+                    self.wco[k] = words[axis] if words.get("L") == 2 else self.position[k] - words[axis]
+            return "ok"
+
+        if not any(axis in words for axis in "XYZ"):
+            return "ok"
+        if jog and "F" not in words:
+            return "error:22"
+        self._plan(words, absolute, rapid=(self.motion == 0 and not jog), jog=jog)
+        return "ok"
+
+    def _plan(self, words, absolute, rapid, jog):
+        with self.cond:
+            # No room in the planner: the line (and the host) waits, like real GRBL
+            while self.running and len(self.planner) >= self.planner_blocks:
+                self.cond.wait(0.01)
+
+            # Target from the position as it stands now (a jog cancel may have moved it)
+            target = list(self.position)
+            for k, axis in enumerate("XYZ"):
+                if axis in words:
+                    target[k] = words[axis] + self.wco[k] if absolute else self.position[k] + words[axis]
+            delta = [t - p for t, p in zip(target, self.position)]
+            distance = math.sqrt(sum(d * d for d in delta))
+            if self.motion in (2, 3) and not jog:
+                distance = self._arc_length(words, delta)
+            if distance <= 1e-9:
+                return
+            rates = [self.settings[110 + k] / 60.0 for k in range(3)]
+            accels = [self.settings[120 + k] for k in range(3)]
+            chord = math.sqrt(sum(d * d for d in delta)) or distance
+            rate_limit = min(r * chord / abs(d) for r, d in zip(rates, delta) if d) if any(delta) else rates[0]
+            accel = min(a * chord / abs(d) for a, d in zip(accels, delta) if d) if any(delta) else accels[0]
+            feed = rate_limit if rapid or self.feed <= 0 else min(self.feed, rate_limit)
+            duration = block_duration(distance, feed, accel) * self.time_scale
+
+            self.planner.append((list(self.position), target, duration, jog))
+            self.stats["max_planner_blocks"] = max(self.stats["max_planner_blocks"], len(self.planner))
+            self.position = target
+            self.cond.notify_all()
+
+    def _arc_length(self, words, delta):
+        """
+        Length of a G2/G3 move in the XY plane from its I/J center offset (plus any Z).
+        """
+        i, j = words.get("I", 0.0), words.get("J", 0.0)
+        a0 = math.atan2(-j, -i)
+        a1 = math.atan2(delta[1] - j, delta[0] - i)
+        sweep = (a0 - a1 if self.motion == 2 else a1 - a0) % (2 * math.pi) or 2 * math.pi
+        return math.hypot(sweep * math.hypot(i, j), delta[2])
+
+    # --- stepper side ---
+    def _executor(self):
+        while self.running:
+            with self.cond:
+                while self.running and (not self.planner or self.held):
+                    self.cond.wait(0.01)
+                if not self.running:
+                    return
+                block = self.planner.popleft()
+                started = time.monotonic()
+                if self.last_block_end is not None:
+                    self.stats["starved_s"] += started - self.last_block_end
+                self.current = (block, started)
+                self.abort_block = False
+                self.cond.notify_all()
+
+            deadline = started + block[2]
+            while self.running and not self.abort_block:
+                remaining = deadline - time.monotonic()
+                if self.held:
+                    deadline += 0.005
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 0.005))
+
+            with self.cond:
+                if not self.abort_block:
+                    self.executed = list(block[1])
+                elif self.current:
+                    # Cancelled mid-move: stop where we were when the cancel arrived
+                    self.executed = self.abort_position or self.current_position()
+                    self.abort_position = None
+                self.current = None
+                self.stats["blocks"] += 1
+                self.stats["busy_s"] += time.monotonic() - started
+                # Only count gaps while more work is on the way
+                self.last_block_end = time.monotonic() if self.planner or b"\n" in self.rx else None
+                self.cond.notify_all()
+
+
+def _strip_host_lines(gcode_path):
+    """
+    Copy of a program without M0 pauses and ;DISPENSE/;STROKE markers, which need an operator
+    and the syringe. Returns the temp file path.
+    """
+    fd, path = tempfile.mkstemp(suffix=".gcode")
+    with open(gcode_path) as src, os.fdopen(fd, "w") as dst:
+        for line in src:
+            if not line.startswith(("M0", ";DISPENSE", ";STROKE")):
+                dst.write(line)
+    return path
+
+
+def benchmark_sender(gcode_path, modes=("stream", "send-response"), time_scale=1.0, max_lines=None):
+    """
+    Streams a program to a fresh emulator in each sender mode and reports wall time,
+    throughput and how long the emulated planner sat starved between moves.
+    """
+    import serial
+    import gcode_sender
+
+    path = _strip_host_lines(gcode_path)
+    if max_lines:
+        with open(path) as f:
+            head = [next(f, "") for _ in range(max_lines)]
+        with open(path, "w") as f:
+            f.writelines(head)
+
+    results = {}
+    try:
+        for mode in modes:
+            with GrblEmulator(time_scale=time_scale) as emu:
+                with serial.Serial(emu.port, gcode_sender.BAUD_RATE, timeout=1) as ser:
+                    ser.reset_input_buffer()
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        gcode_sender.stream_gcode_file(ser, path, mode=mode, pipelined_dispense=False)
+                    # Let the emulator finish executing what's planned
+                    emu._wait_for_idle()
+                    elapsed = time.perf_counter() - start
+                results[mode] = dict(emu.stats, elapsed_s=elapsed,
+                                     lines_per_s=emu.stats["lines"] / elapsed if elapsed else 0.0)
+    finally:
+        os.unlink(path)
+    return results
+
+
+if __name__ == "__main__":
+    gcode_path = sys.argv[1] if len(sys.argv) > 1 else "output/red_person.gcode"
+    time_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    results = benchmark_sender(gcode_path, time_scale=time_scale)
+    for mode, r in results.items():
+        print(f"{mode:>14}: {r['elapsed_s']:.2f} s, {r['lines_per_s']:.0f} lines/s, "
+              f"planner starved {r['starved_s']:.2f} s, max RX {r['max_rx_bytes']} B, "
+              f"max planner {r['max_planner_blocks']}, overflows {r['rx_overflows']}, errors {r['errors']}")
@@ -1,8 +1,11 @@
-from PIL import Image
+from PIL import Image, ImageColor
+import hashlib
+import os
 import numpy as np
 from collections import Counter
-import matplotlib.pyplot as plt
-from matplotlib import colors
+from path_planner import plan_dot_order
+from machine_config import drag_feedrate
+from gcode_sim import simulate
 
 
 color_map = {
@@ -19,62 +22,269 @@ color_map = {
         10: 'white',
     }
 
-def load_and_process_image(image_path, output_size=(100, 100)):
-    img = Image.open(image_path).convert("RGB")
-    img = img.resize(output_size)
-    img_np = np.array(img)
+# color_map as a uint8 RGB table, so a whole dot matrix converts in one indexing step
+COLOR_LUT = np.array([ImageColor.getrgb(color_map[k]) for k in range(len(color_map))], dtype=np.uint8)
 
-    return img_np / 255.0  # Normalize RGB
+def load_and_process_image(image_path, output_size=(100, 100), dtype=np.float32, resample=Image.BOX):
+    """
+    Loads an image at output_size (width, height). JPEGs are decoded straight at the
+    nearest 1/2, 1/4 or 1/8 scale (draft mode) and large images are box-reduced by an
+    integer factor before the final area resample, so full-resolution pixels never hit
+    memory. Returns normalized RGB as float32 by default, or raw uint8 with dtype=np.uint8.
+    """
+    img = Image.open(image_path)
+    img.draft("RGB", output_size)
+    img = img.convert("RGB")
+
+    factor = min(img.width // output_size[0], img.height // output_size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != tuple(output_size):
+        img = img.resize(output_size, resample=resample)
+
+    if np.dtype(dtype) == np.uint8:
+        return np.asarray(img, dtype=np.uint8)
+    img_np = np.asarray(img, dtype=dtype)
+    img_np *= 1 / 255.0  # Normalize RGB
+    return img_np
+
+
+
+# Extended palette (normalized RGB)
+palette = {
+    0: np.array([1.0, 0.0, 0.0]),           # red
+    1: np.array([1.0, 1.0, 0.0]),           # yellow
+    2: np.array([0.0, 0.0, 1.0]),           # blue
+    3: np.array([0.294, 0.0, 0.51]),        # dioxazine purple
+    4: np.array([0.565, 0.933, 0.565]),     # light green
+    5: np.array([0.0, 0.0, 0.0]),           # black
+    6: np.array([0.20, 0.40, 0.20]),        # greenish grey
+    7: np.array([0.541, 0.2, 0.141]),       # burnt umber
+    8: np.array([1.0, 0.38, 0.012]),        # cadmium orange hue
+    9: np.array([0.0, 0.392, 0.0]),         # dark green
+    10: np.array([1.0, 1.0, 1.0]),          # white
+}
 
 
+# Precomputed palette lookup tables: colors are quantized to LUT_BINS levels per channel
+LUT_BINS = 32
+LUT_CACHE_DIR = "cache/lut"
+OKLAB_ALPHA_SCALE = 2.0  # OKLab distances run about half of normalized RGB ones
+_lut_memory = {}
 
-def compute_dominant_color_matrix(color_matrix, region_size=5, alpha=10):
+
+def srgb_to_oklab(rgb):
+    """
+    Converts normalized sRGB (..., 3) to OKLab (..., 3).
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    lms = linear @ np.array([
+        [0.4122214708, 0.5363325363, 0.0514459929],
+        [0.2119034982, 0.6806995451, 0.1073969566],
+        [0.0883024619, 0.2817188376, 0.6299787005],
+    ]).T
+    return np.cbrt(lms) @ np.array([
+        [0.2104542553, 0.7936177850, -0.0040720468],
+        [1.9779984951, -2.4285922050, 0.4505937099],
+        [0.0259040371, 0.7827717662, -0.8086757660],
+    ]).T
+
+
+def _palette_cdf(colors, palette_ids, alpha, color_space):
+    """
+    Cumulative (unnormalized) softmax weights of every color (N, 3) against the palette.
+    """
+    palette_rgb = np.array([palette[k] for k in palette_ids])
+    if color_space == "oklab":
+        colors, palette_rgb = srgb_to_oklab(colors), srgb_to_oklab(palette_rgb)
+        alpha = alpha * OKLAB_ALPHA_SCALE
+    elif color_space != "rgb":
+        raise ValueError(f"Unknown color space: {color_space}")
+    distances = np.linalg.norm(colors[:, None, :] - palette_rgb[None, :, :], axis=2)
+    logits = -alpha * distances
+    weights = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return np.cumsum(weights, axis=1)
+
+
+def load_palette_lut(palette_ids=None, alpha=10, bins=LUT_BINS, color_space="oklab"):
+    """
+    (bins^3, palette) table of cumulative sampling weights for every quantized color,
+    built once per palette/alpha/bins and cached in memory and under LUT_CACHE_DIR.
+    Safe to call from several processes at once: the file is written atomically, and a
+    worker that finds none (or an unreadable one) builds its own.
+    """
+    ids = np.array(sorted(palette if palette_ids is None else palette_ids))
+    palette_rgb = np.array([palette[k] for k in ids])
+    key = hashlib.sha1(b"|".join([
+        ids.astype(np.int64).tobytes(), palette_rgb.astype(np.float64).tobytes(),
+        repr((float(alpha), int(bins), color_space, OKLAB_ALPHA_SCALE, QUANTIZER_VERSION)).encode(),
+    ])).hexdigest()[:16]
+    if key in _lut_memory:
+        return _lut_memory[key]
+
+    path = os.path.join(LUT_CACHE_DIR, f"lut_{key}.npy")
+    lut = _cache_load(path)
+    if lut is None or lut.shape != (bins ** 3, len(ids)):
+        # Bin centers of the quantized RGB cube, in (r, g, b) raster order
+        centers = (np.arange(bins) + 0.5) / bins
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 3)
+        lut = _palette_cdf(grid, ids, alpha, color_space).astype(np.float32)
+        os.makedirs(LUT_CACHE_DIR, exist_ok=True)
+        _atomic_save(path, lut)
+    _lut_memory[key] = lut
+    return lut
+
+
+def compute_dominant_color_matrix(color_matrix, region_size=5, alpha=10, seed=None, palette_ids=None,
+                                  color_space="rgb"):
     """
     Uses color distance matching to an extended paint palette with weighted random sampling.
+    Every region is matched in one batch: block means via reshape, a (cells x palette)
+    distance array, and one uniform draw per cell against the cumulative probabilities.
+    `seed` may be an int or an np.random.Generator for reproducible runs, and
+    `palette_ids` limits matching to a subset of the palette (default: all of it).
+    color_space="oklab" matches perceptually through a cached lookup table (see
+    load_palette_lut) instead of computing raw RGB distances per region.
     Returns a 2D matrix of color IDs.
     """
+    rng = np.random.default_rng(seed)
+
     height, width, _ = color_matrix.shape
     output_rows = height // region_size
     output_cols = width // region_size
-    output_matrix = np.zeros((output_rows, output_cols), dtype=int)
-
-    # Extended palette (normalized RGB)
-    palette = {
-        0: np.array([1.0, 0.0, 0.0]),           # red
-        1: np.array([1.0, 1.0, 0.0]),           # yellow
-        2: np.array([0.0, 0.0, 1.0]),           # blue
-        3: np.array([0.294, 0.0, 0.51]),        # dioxazine purple
-        4: np.array([0.565, 0.933, 0.565]),     # light green
-        5: np.array([0.0, 0.0, 0.0]),           # black
-        6: np.array([0.20, 0.40, 0.20]),        # greenish grey
-        7: np.array([0.541, 0.2, 0.141]),       # burnt umber
-        8: np.array([1.0, 0.38, 0.012]),        # cadmium orange hue
-        9: np.array([0.0, 0.392, 0.0]),         # dark green
-        10: np.array([1.0, 1.0, 1.0]),          # white
-    }
 
-    for i in range(output_rows):
-        for j in range(output_cols):
-            region = color_matrix[
-                i * region_size:(i + 1) * region_size,
-                j * region_size:(j + 1) * region_size
-            ]
-            avg_rgb = region.mean(axis=(0, 1))
+    # Average every region_size x region_size block at once
+    blocks = color_matrix[:output_rows * region_size, :output_cols * region_size]
+    blocks = blocks.reshape(output_rows, region_size, output_cols, region_size, -1)
+    avg_rgb = blocks.mean(axis=(1, 3), dtype=np.float32).reshape(-1, 3)
+    if color_matrix.dtype == np.uint8:
+        avg_rgb /= 255.0
+
+    ids = np.array(sorted(palette if palette_ids is None else palette_ids))
+
+    if color_space == "oklab":
+        # Quantize each mean color to its LUT bin and fetch its weights in one index
+        q = np.clip((avg_rgb * LUT_BINS).astype(np.intp), 0, LUT_BINS - 1)
+        cdf = load_palette_lut(ids, alpha, LUT_BINS, color_space)[(q[:, 0] * LUT_BINS + q[:, 1]) * LUT_BINS + q[:, 2]]
+    else:
+        # Distances to the whole palette, turned into softmax probabilities
+        cdf = _palette_cdf(avg_rgb, ids, alpha, color_space)
+
+    # One uniform draw per cell, inverted through the cumulative weights
+    u = rng.random((cdf.shape[0], 1)) * cdf[:, -1:]
+    chosen = np.minimum((cdf <= u).sum(axis=1), len(ids) - 1)
+
+    return ids[chosen].reshape(output_rows, output_cols)
+
+
+
+# Content-addressed cache of loaded images and dot matrices, evicted least recently used first
+IMAGE_CACHE_DIR = "cache/images"
+IMAGE_CACHE_MAX_BYTES = 256 * 2 ** 20
+IMAGE_LOADER_VERSION = 2  # bump when load_and_process_image output changes
+QUANTIZER_VERSION = 1  # bump when compute_dominant_color_matrix or load_palette_lut output changes
 
-            # Compute distances and turn into inverse-weighted probabilities
-            distances = {k: np.linalg.norm(avg_rgb - v) for k, v in palette.items()}
-            inv_weights = {k: np.exp(-alpha * d) for k, d in distances.items()}
 
-            total_weight = sum(inv_weights.values())
-            probs = {k: w / total_weight for k, w in inv_weights.items()}
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-            # Use probabilities to pick a color
-            ids = list(probs.keys())
-            weights = list(probs.values())
-            chosen_id = np.random.choice(ids, p=weights)
-            output_matrix[i, j] = chosen_id
 
-    return output_matrix
+def _cache_file(cache_dir, kind, key_parts, ext):
+    key = hashlib.sha1(repr(key_parts).encode()).hexdigest()[:20]
+    return os.path.join(cache_dir, f"{kind}_{key}{ext}")
+
+
+def _cache_load(path):
+    try:
+        os.utime(path)  # mark as recently used
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return data["dots"].astype(int)
+        return np.load(path)
+    except FileNotFoundError:  # never cached, or evicted by another process
+        return None
+    except (ValueError, EOFError, OSError, KeyError):  # truncated by a crashed or older writer
+        return None
+
+
+def _atomic_save(path, array):
+    """
+    Writes to a per-process temp file and renames it into place, so readers in other
+    processes see either the old file or the whole new one.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp{os.path.splitext(path)[1]}"  # unique per process
+    if path.endswith(".npz"):
+        np.savez_compressed(tmp, dots=array.astype(np.uint8))
+    else:
+        np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def _cache_store(path, array, cache_dir, max_bytes):
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_save(path, array)
+    evict_image_cache(cache_dir, max_bytes)
+
+
+def evict_image_cache(cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+    """
+    Deletes the least recently used cache entries until the cache fits in max_bytes.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:  # removed by a concurrent writer
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_and_quantize_cached(image_path, output_size=(100, 100), region_size=5, alpha=10, seed=None,
+                             palette_ids=None, color_space="rgb", cache_dir=IMAGE_CACHE_DIR,
+                             max_bytes=IMAGE_CACHE_MAX_BYTES):
+    """
+    load_and_process_image + compute_dominant_color_matrix behind a disk cache keyed by the
+    image content hash and every parameter that affects the result (including the palette
+    colors). With seed=None the draw is random by design, so the dot matrix isn't cached.
+    Returns (color_matrix, dot_matrix).
+    """
+    digest = _file_digest(image_path)
+    image_key = (digest, tuple(output_size), IMAGE_LOADER_VERSION)
+    image_file = _cache_file(cache_dir, "image", image_key, ".npy")
+    color_matrix = _cache_load(image_file)
+    if color_matrix is None:
+        color_matrix = load_and_process_image(image_path, output_size=output_size)
+        _cache_store(image_file, color_matrix, cache_dir, max_bytes)
+
+    cacheable = isinstance(seed, (int, np.integer))
+    ids = sorted(palette if palette_ids is None else palette_ids)
+    dots_key = image_key + (region_size, float(alpha), seed if cacheable else None, color_space,
+                            tuple((k, tuple(palette[k].tolist())) for k in ids),
+                            QUANTIZER_VERSION, LUT_BINS, OKLAB_ALPHA_SCALE)
+    dots_file = _cache_file(cache_dir, "dots", dots_key, ".npz")
+    dot_matrix = _cache_load(dots_file) if cacheable else None
+    if dot_matrix is None:
+        dot_matrix = compute_dominant_color_matrix(color_matrix, region_size, alpha, seed, palette_ids, color_space)
+        if cacheable:
+            _cache_store(dots_file, dot_matrix, cache_dir, max_bytes)
+    return color_matrix, dot_matrix
 
 
 
@@ -82,15 +292,11 @@ def visualize_dot_matrix(dot_matrix, dot_size=100):
     """
     Visualizes a matrix of color IDs as dots on a white canvas using imshow.
     """
+    # Imported here so batch and headless runs never pay for matplotlib
+    import matplotlib.pyplot as plt
 
     # Map the dot_matrix values to actual RGB colors
-    height, width = dot_matrix.shape
-    image = np.zeros((height, width, 3), dtype=np.uint8)
-
-    for color_id, color in color_map.items():
-        # Convert color to RGB tuple using matplotlib.colors.to_rgb
-        rgb_color = np.array(colors.to_rgb(color)) * 255
-        image[dot_matrix == color_id] = rgb_color
+    image = COLOR_LUT[dot_matrix]
 
     # Plot using imshow for much faster rendering
     fig, ax = plt.subplots()
@@ -106,55 +312,368 @@ test_color_map = {
     2: 'blue',   # line
 }
 
-def generate_pointillism_gcode(color_matrix, feedrate=800, z_height=0):
-    gcode = []
-    gcode.append("G90") # absolute coords
-    gcode.append("G10 L20 P1 X0 Y0 Z0")
-    gcode.append("G1 Z3 F500")  # retract from canvas
-    gcode.append("G0 X-100 F800")
-    gcode.append("M0 ; Pause to change color")  # Pause for manual color change
-
-
-    for color_index in range(11): #skip white
-        gcode.append(f"; --- Starting color: {color_map[color_index]} ---")
-
-        y_distance = 0
-        for i in range(color_matrix.shape[0]):#rows
-            y_distance -= 3
-            x_distance = 0
-            for j in range(color_matrix.shape[1]):  #columns
-                x_distance += 3
-                value = color_matrix[i, j]
-                if value == color_index:
-                    gcode.append(f"G0 X{x_distance:.2f} F{feedrate}")
-                    gcode.append(f"G0 Y{y_distance:.2f} F{feedrate}")
-                    gcode.append(";DISPENSE")  # stepper motor dispenses
-                    gcode.append(f"G1 Z{z_height:.2f} F500")  # Move to canvas
-                    gcode.append("G1 Z3 F500") #retract from canvas
-
-        gcode.append(f"G1 Z5 F1000") #  Raise Z first (safe height)
-        gcode.append(f"G0 X-100 F800")  # Then rapid move to home position
-        gcode.append(f"G0 Y0 F800")
-        gcode.append("M0 ; Pause to change color")  #Pause for manual color change
-
-    return gcode
-
-def list_colors_used(dot_matrix):
+def bucket_dots_by_color(color_matrix, n_colors):
+    """
+    Groups every cell of the dot matrix by color ID in a single stable argsort.
+    Returns a list of (rows, cols) index arrays, one per color, in raster order.
+    """
+    flat = np.asarray(color_matrix).ravel().astype(np.intp)
+    order = np.argsort(flat, kind="stable")
+    counts = np.bincount(flat, minlength=n_colors)[:n_colors]
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    cols = color_matrix.shape[1]
+    return [np.divmod(order[bounds[c]:bounds[c + 1]], cols) for c in range(n_colors)]
+
+
+PARK_POSITION = (-100.0, 0.0, 5.0)  # where every color pass starts and ends (X, Y, safe Z)
+STROKE_FEEDRATE = 300  # mm/min, fastest drag; each stroke is slowed to what its syringe move takes
+
+
+def _runs(mask, min_run):
+    """
+    Horizontal runs of at least min_run True cells as (row, first col, last col).
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # same row-major order as the starts
+    keep = ends - starts >= min_run
+    return list(zip(rows[keep].tolist(), starts[keep].tolist(), (ends[keep] - 1).tolist()))
+
+
+def find_strokes(mask, min_run=2):
+    """
+    Covers the True cells of mask with straight strokes and leftover single dots.
+    Takes horizontal runs of at least min_run cells, then vertical runs from what is
+    left (or the other way round, whichever leaves fewer pieces); the rest stay dots.
+    Returns (strokes as ((row0, col0), (row1, col1)), dots as (row, col)).
+    """
+    best = None
+    for vertical_first in (False, True):
+        remaining = np.array(mask, dtype=bool)
+        strokes = []
+        for vertical in (vertical_first, not vertical_first):
+            view = remaining.T if vertical else remaining
+            for line, first, last in _runs(view, min_run):
+                view[line, first:last + 1] = False
+                if vertical:
+                    strokes.append(((first, line), (last, line)))
+                else:
+                    strokes.append(((line, first), (line, last)))
+        dots = list(zip(*(idx.tolist() for idx in np.nonzero(remaining))))
+        if best is None or len(strokes) + len(dots) < len(best[0]) + len(best[1]):
+            best = (strokes, dots)
+    return best
+
+
+def _cell_xy(row, col):
+    return 3 * (col + 1), -3 * (row + 1)
+
+
+def _xy_cell(x, y):
+    return int(round(-y / 3)) - 1, int(round(x / 3)) - 1
+
+
+WHITE = 10  # the canvas color; painting it is usually wasted time
+COLOR_ORDERS = ("id", "light-to-dark")
+
+
+def plan_color_passes(dot_matrix, color_order="id", skip_colors=(WHITE,)):
+    """
+    Color IDs to paint, one pass each: only colors actually in the dot matrix, minus
+    skip_colors. "light-to-dark" orders passes by OKLab lightness so a dark paint never
+    has to be cleaned out of the syringe before a light one.
+    """
+    if color_order not in COLOR_ORDERS:
+        raise ValueError(f"Unknown color order: {color_order} (expected one of {COLOR_ORDERS})")
+    passes = [int(c) for c, _ in list_colors_used(dot_matrix, verbose=False) if c not in skip_colors]
+    if color_order == "light-to-dark":
+        passes.sort(key=lambda c: -srgb_to_oklab(palette[c])[0])
+    return passes
+
+
+_PREAMBLE = (
+    "G90", # absolute coords
+    "G10 L20 P1 X0 Y0 Z0",
+    "G1 Z3 F500",  # retract from canvas
+    "G0 X-100 F800",
+    "M0 ; Pause to change color",  # Pause for manual color change
+)
+
+
+class PointillismToolpath:
+    """
+    Pointillism G-code for a dot matrix that may be edited between exports. Every color
+    pass starts and ends at the park position, so a pass only depends on the cells of its
+    own color: passes are built once and cached per color, and update() drops only the
+    passes of colors an edit touched. iter_pointillism_gcode runs one with an empty cache.
+
+    Options are those of iter_pointillism_gcode that shape a pass; color_order and
+    skip_colors only choose which cached passes go out, so they are given to iter_gcode.
+    verbose=False silences the planner and summary printouts (for previews).
+
+    For the same reason a pass's run time doesn't depend on the others: estimate() keeps
+    one simulated time per pass next to its lines and only simulates the rebuilt ones.
+    """
+
+    def __init__(self, color_matrix, feedrate=800, z_height=0, optimize_path=False, time_budget=1.0,
+                 stroke_mode=False, min_run=2, stroke_feedrate=STROKE_FEEDRATE, max_dots_per_color=None,
+                 verbose=True):
+        self.options = dict(feedrate=feedrate, z_height=z_height, optimize_path=optimize_path,
+                            time_budget=time_budget, stroke_mode=stroke_mode, min_run=min_run,
+                            stroke_feedrate=stroke_feedrate, max_dots_per_color=max_dots_per_color)
+        self.color_matrix = np.array(color_matrix)
+        self.verbose = verbose
+        self._passes = {}  # color ID -> (G-code lines, stats, pieces in painting order)
+        self._estimates = {}  # color ID -> simulated seconds of its pass
+
+    def set_options(self, **options):
+        """
+        Changes pass options, dropping every cached pass if any of them actually changed.
+        """
+        unknown = set(options) - set(self.options)
+        if unknown:
+            raise TypeError(f"Unknown toolpath options: {sorted(unknown)}")
+        if any(self.options[k] != v for k, v in options.items()):
+            self._passes.clear()
+            self._estimates.clear()
+        self.options.update(options)
+
+    def update(self, color_matrix):
+        """
+        Takes the edited matrix and forgets the passes of every color that gained or lost
+        a cell. Returns the set of colors that will be rebuilt.
+        """
+        color_matrix = np.asarray(color_matrix)
+        if color_matrix.shape != self.color_matrix.shape:
+            stale = set(self._passes)
+            self._passes.clear()
+            self._estimates.clear()
+            self.color_matrix = color_matrix.copy()
+            return stale
+        changed = self.color_matrix != color_matrix
+        stale = set(np.unique(self.color_matrix[changed]).tolist()) | set(np.unique(color_matrix[changed]).tolist())
+        for color_index in stale:
+            self._passes.pop(color_index, None)
+            self._estimates.pop(color_index, None)
+        self.color_matrix[...] = color_matrix
+        return stale
+
+    def _build(self, colors):
+        missing = [c for c in colors if c not in self._passes]
+        if not missing:
+            return
+        if self.options["stroke_mode"]:
+            for color_index in missing:
+                self._passes[color_index] = self._build_pass(color_index, None)
+            return
+        if len(missing) > 1:
+            buckets = bucket_dots_by_color(self.color_matrix, len(color_map))
+        else:
+            flat = np.flatnonzero(self.color_matrix == missing[0])  # same raster order as the buckets
+            buckets = {missing[0]: np.divmod(flat, self.color_matrix.shape[1])}
+        for color_index in missing:
+            self._passes[color_index] = self._build_pass(color_index, buckets[color_index])
+
+    def _build_pass(self, color_index, cells):
+        opts = self.options
+        feedrate, z_height = opts["feedrate"], opts["z_height"]
+        max_dots_per_color = opts["max_dots_per_color"]
+        park = PARK_POSITION[:2]
+        stats = dict(dots=0, strokes=0, cells=0, refills=0, before=0.0, after=0.0)
+        lines = [f"; --- Starting color: {color_map[color_index]} ---"]
+
+        # Each piece is (first cell, last cell); a dot starts and ends on the same cell
+        if opts["stroke_mode"]:
+            strokes, dots = find_strokes(self.color_matrix == color_index, opts["min_run"])
+            pieces = [(_cell_xy(*a), _cell_xy(*b)) for a, b in strokes]
+            pieces += [(_cell_xy(*d),) * 2 for d in dots]
+            pieces.sort(key=lambda p: (-p[0][1], p[0][0]))  # raster order of the first cell
+        else:
+            rows, cols = cells
+            pieces = [(xy, xy) for xy in zip((3 * (cols + 1)).tolist(), (-3 * (rows + 1)).tolist())]
+
+        if opts["optimize_path"] and pieces:
+            by_start = {p[0]: p for p in pieces}
+            ordered, before, after = plan_dot_order(list(by_start), start=park, time_budget=opts["time_budget"])
+            pieces = [by_start[xy] for xy in ordered]
+            stats["before"], stats["after"] = before, after
+        if opts["optimize_path"] and pieces and self.verbose:
+            what = f"{len(strokes)} strokes + {len(dots)} dots" if opts["stroke_mode"] else f"{len(pieces)} dots"
+            print(f"  {color_map[color_index]}: {what}, travel {before / 1000:.2f} m -> {after / 1000:.2f} m")
+
+        px, py = park
+        path = []
+        for k, (first, last) in enumerate(pieces):
+            if max_dots_per_color and k and k % max_dots_per_color == 0:
+                lines.append("G1 Z5 F1000")  # Raise Z first (safe height)
+                lines.append("G0 X-100 F800")
+                lines.append("G0 Y0 F800")
+                lines.append(f"M0 ; Pause to refill {color_map[color_index]}")
+                stats["refills"] += 1
+                px, py = park
+            if abs(last[0] - px) + abs(last[1] - py) < abs(first[0] - px) + abs(first[1] - py):
+                first, last = last, first
+            lines.append(f"G0 X{first[0]:.2f} F{feedrate}")
+            lines.append(f"G0 Y{first[1]:.2f} F{feedrate}")
+            if first == last:
+                lines.append(";DISPENSE")  # stepper motor dispenses
+                lines.append(f"G1 Z{z_height:.2f} F500")  # Move to canvas
+                stats["dots"] += 1
+                stats["cells"] += 1
+            else:
+                length = abs(last[0] - first[0]) + abs(last[1] - first[1])
+                run = length // 3 + 1
+                axis, target = ("X", last[0]) if first[1] == last[1] else ("Y", last[1])
+                feed = min(opts['stroke_feedrate'], drag_feedrate(length, run))
+                lines.append(f"G1 Z{z_height:.2f} F500")  # Move to canvas
+                lines.append(f";STROKE {run}")  # stepper dispenses along the whole drag
+                lines.append(f"G1 {axis}{target:.2f} F{feed:.2f}")  # as long as the syringe takes
+                stats["strokes"] += 1
+                stats["cells"] += run
+            lines.append("G1 Z3 F500")  # retract from canvas
+            path.append((first, last))
+            px, py = last
+
+        lines.append("G1 Z5 F1000")  # Raise Z first (safe height)
+        lines.append("G0 X-100 F800")  # Then rapid move to home position
+        lines.append("G0 Y0 F800")
+        return lines, stats, path
+
+    def pass_path(self, color_index):
+        """
+        Painting order of one color as [(first cell, last cell), ...] with cells as (row, col);
+        a dot's first and last cell are the same. Builds the pass if it isn't cached.
+        """
+        self._build([color_index])
+        return [(_xy_cell(*first), _xy_cell(*last)) for first, last in self._passes[color_index][2]]
+
+    def estimate(self, color_order="id", skip_colors=(WHITE,)):
+        """
+        What simulate would report for iter_gcode's program, summed from the cached
+        per-pass times (each pass timed on its own from PARK_POSITION, at rest as it is
+        after every pause). Returns {"total_time": s, "cells": painted cells, "pauses": M0s}.
+        """
+        passes = plan_color_passes(self.color_matrix, color_order, skip_colors)
+        self._build(passes)
+        for color_index in passes:
+            if color_index not in self._estimates:
+                lines = self._passes[color_index][0]
+                self._estimates[color_index] = simulate("\n".join(lines) + "\n", start=PARK_POSITION)["total_time"]
+        stats = [self._passes[color_index][1] for color_index in passes]
+        preamble = simulate("\n".join(_PREAMBLE) + "\n")["total_time"]
+        return {
+            "total_time": preamble + sum(self._estimates[color_index] for color_index in passes),
+            "cells": sum(s["cells"] for s in stats),
+            "pauses": len(passes) + sum(s["refills"] for s in stats),  # the initial load, then one per pass
+        }
+
+    def iter_gcode(self, color_order="id", skip_colors=(WHITE,)):
+        """
+        Yields the whole program, building only the passes that aren't cached.
+        """
+        yield from _PREAMBLE
+
+        passes = plan_color_passes(self.color_matrix, color_order, skip_colors)
+        self._build(passes)
+        for pass_index, color_index in enumerate(passes):
+            yield from self._passes[color_index][0]
+            if pass_index < len(passes) - 1:
+                yield "M0 ; Pause to change color"  #Pause for manual color change
+
+        if not self.verbose:
+            return
+        total = Counter()
+        for color_index in passes:
+            total.update(self._passes[color_index][1])
+        pauses = len(passes) + total["refills"]
+        if self.options["optimize_path"]:
+            print(f"🧭 XY travel: {total['before'] / 1000:.2f} m -> {total['after'] / 1000:.2f} m "
+                  f"(saved {(total['before'] - total['after']) / 1000:.2f} m)")
+        if self.options["stroke_mode"]:
+            n_strokes, n_dots = total["strokes"], total["dots"]
+            print(f"✏️ {total['cells']} cells painted as {n_strokes} strokes and {n_dots} dots "
+                  f"({n_strokes + n_dots} plunges instead of {total['cells']})")
+        legacy = len(color_map) + 1  # one pause per palette color plus the initial load
+        print(f"⏸️ {len(passes)} color passes, {pauses} pauses ({total['refills']} refills) "
+              f"instead of {legacy}, saved {legacy - pauses}")
+
+
+def iter_pointillism_gcode(color_matrix, feedrate=800, z_height=0, optimize_path=False, time_budget=1.0,
+                           stroke_mode=False, min_run=2, stroke_feedrate=STROKE_FEEDRATE, color_order="id",
+                           skip_colors=(WHITE,), max_dots_per_color=None):
+    """
+    Yields dot G-code lines lazily, one color pass at a time. Dots are bucketed by color
+    in one pass over the matrix. With optimize_path the dots in each pass are reordered
+    by path_planner (nearest neighbor + 2-opt/Or-opt, time_budget seconds per pass) and
+    the XY travel before/after is printed.
+
+    Only colors present in the matrix get a pass (see plan_color_passes for color_order
+    and skip_colors), and there is no pause after the last one. max_dots_per_color splits
+    big passes with a refill pause every that many dots (or strokes).
+
+    With stroke_mode, runs of at least min_run same-colored cells in a row or column are
+    painted as one plunge and a G1 drag, marked ";STROKE <cells>" so the sender dispenses
+    for the whole run while the drag moves. The drag is fed so it takes as long as the
+    syringe does for those cells (machine_config.drag_feedrate), at most stroke_feedrate.
+    Isolated cells stay dots, and each stroke is entered from whichever end is closer to
+    the previous piece.
+
+    To regenerate after small edits, keep a PointillismToolpath instead.
+    """
+    toolpath = PointillismToolpath(color_matrix, feedrate, z_height, optimize_path, time_budget, stroke_mode,
+                                   min_run, stroke_feedrate, max_dots_per_color)
+    return toolpath.iter_gcode(color_order, skip_colors)
+
+
+def generate_pointillism_gcode(color_matrix, feedrate=800, z_height=0, optimize_path=False, time_budget=1.0,
+                               stroke_mode=False, min_run=2, stroke_feedrate=STROKE_FEEDRATE, color_order="id",
+                               skip_colors=(WHITE,), max_dots_per_color=None):
+    """
+    List form of iter_pointillism_gcode, for callers that need every line at once.
+    """
+    return list(iter_pointillism_gcode(color_matrix, feedrate, z_height, optimize_path, time_budget,
+                                       stroke_mode, min_run, stroke_feedrate, color_order, skip_colors,
+                                       max_dots_per_color))
+
+
+def write_gcode(gcode_lines, output_path, buffer_size=1 << 16):
+    """
+    Writes an iterable of G-code lines through a buffered file sink.
+    Returns the number of lines written.
+    """
+    count = 0
+    with open(output_path, "w", buffering=buffer_size) as f:
+        for line in gcode_lines:
+            f.write(line + "\n")
+            count += 1
+    return count
+
+def list_colors_used(dot_matrix, verbose=True):
     unique_ids = np.unique(dot_matrix)
     used_colors = [(color_id, color_map[color_id]) for color_id in unique_ids]
-    print("🎨 Colors used in this image:")
-    for color_id, name in used_colors:
-        print(f"  ID {color_id}: {name}")
+    if verbose:
+        print("🎨 Colors used in this image:")
+        for color_id, name in used_colors:
+            print(f"  ID {color_id}: {name}")
     return used_colors
 
 # === Example usage ===
 if __name__ == "__main__":
     GENERATE_GCODE = True
     VISUALIZE_DOT_MATRIX = True
+    OPTIMIZE_PATH = True
+    STROKE_MODE = False  # drag same-colored runs instead of plunging once per cell
+    COLOR_ORDER = "light-to-dark"  # or "id" for palette order
+    MAX_DOTS_PER_COLOR = None  # refill pause every this many dots, None for no limit
+    OPTIMIZE_GCODE = True  # merge rapids, drop repeated modal words (see gcode_optimizer.py)
+    COLOR_SPACE = "oklab"  # "rgb" for the original raw RGB distance matching
+    SEED = 0  # None for a fresh random draw every run (dot matrix is then not cached)
 
     image_path = "images/THEIMAGE.jpeg"  # Replace with image path
-    color_matrix = load_and_process_image(image_path, output_size=(330, 415))
-    dot_matrix = compute_dominant_color_matrix(color_matrix, region_size=5)
+    color_matrix, dot_matrix = load_and_quantize_cached(image_path, output_size=(330, 415), region_size=5,
+                                                        seed=SEED, color_space=COLOR_SPACE)
 
     list_colors_used(dot_matrix)
 
@@ -163,10 +682,12 @@ if __name__ == "__main__":
 
     if GENERATE_GCODE:
         #Generate G-code
-        gcode_lines = generate_pointillism_gcode(dot_matrix)
+        gcode_lines = iter_pointillism_gcode(dot_matrix, optimize_path=OPTIMIZE_PATH, stroke_mode=STROKE_MODE,
+                                             color_order=COLOR_ORDER, max_dots_per_color=MAX_DOTS_PER_COLOR)
+        if OPTIMIZE_GCODE:
+            from gcode_optimizer import optimize_gcode
+            gcode_lines = optimize_gcode(gcode_lines)
         output_path = "output/pointillism.gcode"
-        with open(output_path, "w") as f:
-            for line in gcode_lines:
-                f.write(line + "\n")
+        write_gcode(gcode_lines, output_path)
 
         print(f"G-code written to {output_path}")
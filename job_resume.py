@@ -0,0 +1,266 @@
+import json
+import mmap
+import os
+import re
+import sys
+import time
+import numpy as np
+import serial
+
+from gcode_sender import (SERIAL_PORT, BAUD_RATE, STREAM_MODES, send_gcode_line, manual_color_change,
+                          stream_gcode_file, get_key)
+from gcode_sim import parse_gcode, modal_state
+
+RETRACT_Z = 3.0  # a dot or stroke is finished once the nozzle is back up here
+SAFE_Z = 5.0  # height for the repositioning move on resume
+JOG_STEP = 1.0  # mm per arrow key while putting the nozzle back on work zero
+JOG_STEP_Z = 0.5  # mm per u/d key
+CHECKPOINT_INTERVAL = 2.0  # seconds between checkpoint writes while streaming
+_COLOR = re.compile(rb"(?m)^; --- Starting color: (.*?) ---")
+_MARKER = re.compile(rb"(?m)^;(?:DISPENSE|STROKE)")
+_MPOS = re.compile(r"MPos:(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)")
+
+
+def index_job(gcode_path):
+    """
+    One pass over the file (through mmap) for everything a resume needs: the byte offset
+    of every line, the dot/stroke markers, M0 pauses and color blocks, where each dot is
+    finished (nozzle back at RETRACT_Z) and the modal state after every line.
+    Line numbers are 1-based, like the sender's.
+    """
+    with open(gcode_path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise ValueError(f"{gcode_path} is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            newlines = np.flatnonzero(np.frombuffer(mm, dtype=np.uint8) == ord("\n"))
+            words = parse_gcode(mm)
+            line_starts = np.concatenate(([0], newlines + 1))[:len(words["G"])]
+            colors = [(int(np.searchsorted(line_starts, m.start(), side="right")), m.group(1).decode())
+                      for m in _COLOR.finditer(mm)]
+            markers = np.searchsorted(line_starts, [m.start() for m in _MARKER.finditer(mm)], side="right")
+
+    motion_mode, is_move, pos, feed = modal_state(words)
+    retracts = np.flatnonzero(is_move & (words["Z"] >= RETRACT_Z)) + 1
+    if len(retracts):
+        ends = retracts[np.minimum(np.searchsorted(retracts, markers, side="right"), len(retracts) - 1)]
+    else:
+        ends = markers
+    first_move = int(np.argmax(is_move)) if is_move.any() else len(is_move)
+
+    return {
+        "path": os.path.abspath(gcode_path),
+        "lines": len(line_starts),
+        "offsets": line_starts,
+        "markers": markers,
+        "dot_ends": np.where(ends > markers, ends, markers),
+        "pauses": np.flatnonzero(words["M"] == 0) + 1,
+        "colors": colors,
+        "motion_mode": motion_mode,
+        "pos": pos,
+        "feed": feed,
+        "sets_origin": bool((words["G"][:first_move] == 10).any()),
+    }
+
+
+def resume_point(index, synced_line):
+    """
+    First line to stream again, given the last line GRBL was known to have executed up to.
+    A dot counts as done only if a later sync confirmed its retract; the first dot that
+    isn't confirmed is painted again from its travel move. 1 means start over.
+    """
+    markers, ends = index["markers"], index["dot_ends"]
+    done = ends[(markers < synced_line) & (ends < synced_line)]
+    pauses = index["pauses"][index["pauses"] <= synced_line]
+    last = max(done.max(initial=0), pauses.max(initial=0))
+    return int(last) + 1
+
+
+def color_at(index, line_number):
+    """
+    Name of the color block a line belongs to, if the file still has its color comments.
+    """
+    names = [name for line, name in index["colors"] if line <= line_number]
+    return names[-1] if names else None
+
+
+def restore_preamble(index, line_number, origin=None):
+    """
+    G-code that puts GRBL back in the state the program had just before line_number:
+    absolute mode, the job's work offset, nozzle raised to SAFE_Z, over the last position,
+    down to its height, then the modal motion mode and feed the next lines rely on.
+
+    The work offset: origin, the machine position the job zeroed at, is applied with
+    G10 L2, which is only right if the machine was homed both then and now. Without it, a
+    job that sets its own origin is re-zeroed with G10 L20 where the nozzle is, so it has
+    to be sitting on the job's work zero (see confirm_work_zero).
+    """
+    k = line_number - 2  # 0-based index of the line before it
+    x, y, z = index["pos"][k]
+    mode = int(index["motion_mode"][k])
+    feed = index["feed"][k]
+    lines = ["G90"]
+    if origin is not None:
+        lines.append("G10 L2 P1 X{:.3f} Y{:.3f} Z{:.3f}".format(*origin))
+    elif index["sets_origin"]:
+        lines.append("G10 L20 P1 X0 Y0 Z0")
+    lines.append(f"G1 Z{SAFE_Z:.2f} F1000")  # Raise Z first (safe height)
+    lines.append(f"G0 X{x:.3f} Y{y:.3f}")
+    if z < SAFE_Z:
+        lines.append(f"G1 Z{z:.3f} F500")
+    lines.append(f"G{mode} F{feed:g}" if feed else f"G{mode}")
+    return lines
+
+
+def query_machine_position(ser, timeout=2.0):
+    """
+    Machine position (MPos) from a status report, or None if GRBL doesn't send one.
+    """
+    ser.write(b"?")
+    ser.flush()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        match = _MPOS.search(ser.readline().decode("utf-8", errors="ignore"))
+        if match:
+            return [float(v) for v in match.groups()]
+    return None
+
+
+def confirm_work_zero(ser):
+    """
+    Has the operator jog the nozzle back to the job's work zero (arrows for X/Y, u/d for
+    Z) and confirm with ENTER. After a reconnect GRBL's machine position counts from
+    wherever it powered up, so only the operator knows where the job's origin is.
+    """
+    print("[RESUME] Jog the nozzle to the job's work zero (←/→ X, ↑/↓ Y, u/d Z), then press ENTER")
+    jogs = {'\x1b[D': f"X-{JOG_STEP}", '\x1b[C': f"X{JOG_STEP}", '\x1b[A': f"Y{JOG_STEP}",
+            '\x1b[B': f"Y-{JOG_STEP}", 'u': f"Z{JOG_STEP_Z}", 'd': f"Z-{JOG_STEP_Z}"}
+    while True:
+        key = get_key()
+        if key == 'ENTER':
+            break
+        if key in jogs:
+            print(send_gcode_line(ser, f"$J=G91 {jogs[key]} F500"))
+        else:
+            print(f"Unknown key: {repr(key)}")
+
+
+class JobCheckpoint:
+    """
+    Last confirmed line of a job, kept in a small JSON file next to the G-code. Writes are
+    atomic and throttled to every `interval` seconds; call save() to force one.
+    """
+
+    def __init__(self, gcode_path, path=None, interval=CHECKPOINT_INTERVAL):
+        self.gcode_path = os.path.abspath(gcode_path)
+        self.path = path or gcode_path + ".checkpoint.json"
+        self.interval = interval
+        self.synced_line = 0
+        self.origin = None
+        self._last_write = 0.0
+
+    def _fingerprint(self):
+        st = os.stat(self.gcode_path)
+        return {"gcode": self.gcode_path, "size": st.st_size, "mtime": st.st_mtime}
+
+    def load(self):
+        """
+        Restores a saved checkpoint. Returns False if there is none or the G-code changed.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        fingerprint = self._fingerprint()
+        if any(data.get(k) != v for k, v in fingerprint.items()):
+            print(f"⚠️ Ignoring {self.path}: it was written for a different version of the file")
+            return False
+        self.synced_line = data["synced_line"]
+        self.origin = data.get("origin")
+        return True
+
+    def synced(self, line_number):
+        self.synced_line = line_number
+        if time.monotonic() - self._last_write >= self.interval:
+            self.save()
+
+    def save(self):
+        data = dict(self._fingerprint(), synced_line=self.synced_line, origin=self.origin, updated=time.time())
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self._last_write = time.monotonic()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream_resumable(ser, gcode_path, mode="stream", pipelined_dispense=False, checkpoint_path=None, resume=True,
+                     homed=False, on_origin=confirm_work_zero):
+    """
+    stream_gcode_file with a checkpoint: picks up after the last confirmed dot if a
+    checkpoint for this exact file exists, otherwise starts from the top (remembering the
+    machine position the job's G10 sets as origin). The checkpoint is removed once the
+    job finishes without errors.
+
+    The saved origin is only reused with homed, when the machine was homed ($H) before
+    the job and again since the reconnect. Otherwise on_origin(ser) must put the nozzle
+    back on the job's work zero (the default asks the operator to jog there) and the
+    job is re-zeroed there, as its own G10 did.
+    """
+    index = index_job(gcode_path)
+    checkpoint = JobCheckpoint(gcode_path, checkpoint_path)
+    start_line = 1
+    if resume and checkpoint.load():
+        start_line = resume_point(index, checkpoint.synced_line)
+
+    if start_line > 1:
+        done = int(np.count_nonzero(index["markers"] < start_line))
+        color = color_at(index, start_line)
+        print(f"[RESUME] Line {start_line} of {index['lines']}, {done}/{len(index['markers'])} dots done"
+              + (f", color {color}" if color else ""))
+        origin = checkpoint.origin if homed else None
+        if origin is None and index["sets_origin"]:
+            on_origin(ser)
+        for cmd in restore_preamble(index, start_line, origin):
+            print(send_gcode_line(ser, cmd))
+        print("[RESUME] Load the paint for this color, then continue")
+        manual_color_change(ser)
+    elif index["sets_origin"]:
+        checkpoint.origin = query_machine_position(ser)
+        ser.reset_input_buffer()
+    checkpoint.synced_line = start_line - 1
+    checkpoint.save()
+
+    try:
+        errors = stream_gcode_file(ser, gcode_path, mode, pipelined_dispense,
+                                   start_offset=int(index["offsets"][start_line - 1]), start_line=start_line,
+                                   on_sync=checkpoint.synced)
+    finally:
+        checkpoint.save()
+    if not errors:
+        checkpoint.clear()
+    return errors
+
+
+def send_resumable(gcode_path, mode="stream", pipelined_dispense=False, checkpoint_path=None, resume=True,
+                   homed=False):
+    """
+    Opens the GRBL serial port and runs stream_resumable.
+    """
+    if mode not in STREAM_MODES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {STREAM_MODES})")
+
+    with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
+        time.sleep(2)
+        ser.reset_input_buffer()
+        return stream_resumable(ser, gcode_path, mode, pipelined_dispense, checkpoint_path, resume, homed)
+
+
+if __name__ == "__main__":
+    gcode_path = sys.argv[1] if len(sys.argv) > 1 else "output/pointillism.gcode"
+    fresh = "--restart" in sys.argv[2:]
+    homed = "--homed" in sys.argv[2:]  # homed before the job and since: trust the saved origin
+    send_resumable(gcode_path, resume=not fresh, homed=homed)
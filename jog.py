@@ -1,17 +1,254 @@
+import contextlib
 import tkinter as tk
 from tkinter import ttk
+import queue
+import threading
 import serial
 import time
-#from gcode_sender import send_gcode_line, setup_grbl, send_gcode_file
+from gcode_sender import send_gcode_line, setup_grbl, stream_gcode_file
+from syringe_stepper import move_motor
 
 SERIAL_PORT = "/dev/ttyACM0"
 BAUD_RATE = 115200
 DEBUG_MODE = True
 
+STATUS_HZ = 8          # '?' status queries per second
+GUI_POLL_MS = 50       # how often the GUI drains worker responses
+LINE_TIMEOUT = 1.0     # seconds to wait for ok/error on a single command
+SETUP_TIMEOUT = 1.0    # serial read timeout while configuring (setup_grbl gives up after a few empty reads)
+
+# Continuous jogging streams short $J increments. Each one covers JOG_INTERVAL seconds of
+# travel at the jog feedrate, and JOG_QUEUE_DEPTH of them are kept ahead of the machine so
+# the planner never starves; releasing sends JOG_CANCEL so it stops within milliseconds.
+JOG_INTERVAL = 0.05    # seconds of motion per jog increment
+JOG_QUEUE_DEPTH = 4    # increments in flight
+JOG_CANCEL = b'\x85'   # GRBL real-time jog cancel
+HOLD_DELAY_MS = 250    # press longer than this to jog continuously instead of one step
+KEY_RELEASE_MS = 40    # ignore X11 key auto-repeat release/press pairs
+
+JOG_KEYS = {
+    "Left": ("X", -1), "Right": ("X", 1),
+    "Up": ("Y", 1), "Down": ("Y", -1),
+    "Prior": ("Z", 1), "Next": ("Z", -1),  # Page Up / Page Down
+}
+
+
+def parse_status(report):
+    """
+    Parses a GRBL status report like <Idle|MPos:0.000,0.000,0.000|FS:0,0>.
+    Returns {"state": str, "pos": (x, y, z), "frame": "MPos"/"WPos"} or None.
+    """
+    report = report.strip()
+    if not (report.startswith('<') and report.endswith('>')):
+        return None
+    fields = report[1:-1].split('|')
+    status = {"state": fields[0], "pos": None, "frame": None}
+    for field in fields[1:]:
+        name, _, value = field.partition(':')
+        if name in ("MPos", "WPos"):
+            status["pos"] = tuple(float(v) for v in value.split(',')[:3])
+            status["frame"] = name
+    return status
+
+
+class StatusPollingSerial:
+    """
+    Wraps the serial port for the I/O worker: every readline sends a '?' when a status
+    query is due and hands status reports to on_status instead of returning them, so
+    the sender code never sees them. Writes are serialized with a lock so real-time
+    bytes from the GUI thread can go out while a job is running; it is reentrant so a
+    caller can hold it across a check and the write that depends on it.
+    """
+
+    def __init__(self, ser, on_status, interval=1.0 / STATUS_HZ):
+        self.ser = ser
+        self.on_status = on_status
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.next_poll = 0.0
+        self.polling = True
+
+    def write(self, data):
+        with self.lock:
+            return self.ser.write(data)
+
+    def readline(self):
+        now = time.monotonic()
+        if self.polling and now >= self.next_poll:
+            self.next_poll = now + self.interval
+            self.write(b'?')
+        line = self.ser.readline()
+        status = parse_status(line.decode('utf-8', errors='ignore'))
+        if status:
+            self.on_status(status)
+            return b''
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class SerialWorker(threading.Thread):
+    """
+    Owns the serial port. The GUI posts jobs to `commands` and reads
+    ("response" | "message" | "status" | "error", payload) tuples from `responses`.
+    """
+
+    def __init__(self, ser):
+        super().__init__(daemon=True)
+        ser.timeout = 0.05  # short reads so status polls and new jobs are never starved
+        self.port = StatusPollingSerial(ser, lambda status: self.responses.put(("status", status)))
+        self.commands = queue.Queue()
+        self.responses = queue.Queue()
+        self.running = True
+        self.jog_id = 0  # bumped on every start/stop so a stale jog loop exits
+        self.resume_event = threading.Event()  # set by the GUI to continue after an M0
+
+    def submit(self, kind, payload=None):
+        self.commands.put((kind, payload))
+
+    def realtime(self, byte):
+        """
+        Real-time commands skip the queue; GRBL acts on them even mid-line.
+        """
+        self.port.write(byte)
+        self.port.flush()
+
+    def start_jog(self, axis, direction, feedrate):
+        self.jog_id += 1
+        self.submit("jog", (self.jog_id, axis, direction, feedrate))
+
+    def stop_jog(self):
+        """
+        Stops feeding increments and cancels whatever is already planned. The id bump and
+        the cancel go out under the port lock, so no increment can be written after it.
+        """
+        with self.port.lock:
+            self.jog_id += 1
+            self.realtime(JOG_CANCEL)
+
+    def stream_jog(self, jog_id, axis, direction, feedrate):
+        step = feedrate / 60.0 * JOG_INTERVAL * direction
+        cmd = f"$J=G91 {axis}{step:.3f} F{feedrate}\n".encode()
+        in_flight = 0
+        while self.running and self.jog_id == jog_id:
+            while in_flight < JOG_QUEUE_DEPTH:
+                # Checked under the same lock stop_jog sends the cancel with: an increment
+                # written after 0x85 would start the jog again once the key is up
+                with self.port.lock:
+                    if self.jog_id != jog_id:
+                        break
+                    self.port.write(cmd)
+                in_flight += 1
+            resp = self.port.readline().decode('utf-8', errors='ignore').strip()
+            if resp == 'ok':
+                in_flight -= 1
+            elif resp.startswith('error') or resp.startswith('ALARM'):
+                self.responses.put(("error", f"[GRBL] {resp} while jogging {axis}"))
+                break
+            elif resp:
+                self.responses.put(("message", f"[GRBL] {resp}"))
+
+        # Collect the acks for increments that were already sent. Ones still on the wire when
+        # the cancel went out are planned after it (0x85 only flushes the planner), so once
+        # they're all in, cancel again; the next jog job hasn't written anything yet
+        late = in_flight > 0
+        deadline = time.monotonic() + LINE_TIMEOUT
+        while in_flight > 0 and time.monotonic() < deadline:
+            resp = self.port.readline().decode('utf-8', errors='ignore').strip()
+            if resp == 'ok' or resp.startswith('error'):
+                in_flight -= 1
+        if late:
+            self.realtime(JOG_CANCEL)
+        return f"Jog {axis} stopped"
+
+    def stop(self):
+        self.jog_id += 1
+        self.running = False
+        self.resume_event.set()
+        self.join(timeout=2)
+
+    @contextlib.contextmanager
+    def blocking_reads(self, timeout=SETUP_TIMEOUT):
+        """
+        Long reads and no status polling, for code that treats an empty read as "GRBL
+        didn't answer" (setup_grbl): 0.05 s reads and status reports would end its wait early.
+        """
+        ser = self.port.ser
+        old_timeout = ser.timeout
+        ser.timeout = timeout
+        self.port.polling = False
+        try:
+            yield
+        finally:
+            ser.timeout = old_timeout
+            self.port.polling = True
+
+    def wait_for_operator(self, ser):
+        """
+        M0 during a file job: asks the GUI to pause (there's no terminal to read from this
+        thread) and holds the job until the operator resumes it there.
+        """
+        self.resume_event.clear()
+        self.responses.put(("pause", "Paused (M0): load the next color, then Resume"))
+        while self.running and not self.resume_event.wait(0.1):
+            pass
+        ser.write(b'~')  # Resume GRBL
+        ser.flush()
+
+    def resume(self):
+        self.resume_event.set()
+
+    def send_line(self, cmd):
+        self.port.write((cmd.strip() + '\n').encode())
+        deadline = time.monotonic() + LINE_TIMEOUT
+        while time.monotonic() < deadline:
+            resp = self.port.readline().decode('utf-8', errors='ignore').strip()
+            if resp == 'ok' or resp.startswith('error') or resp.startswith('ALARM'):
+                return f"[GRBL] {resp}"
+            if resp:
+                self.responses.put(("message", f"[GRBL] {resp}"))
+        return f"[GRBL] no response to {cmd}"
+
+    def run(self):
+        while self.running:
+            try:
+                kind, payload = self.commands.get(timeout=0.02)
+            except queue.Empty:
+                # Idle: keep status fresh and surface unsolicited messages
+                resp = self.port.readline().decode('utf-8', errors='ignore').strip()
+                if resp:
+                    self.responses.put(("message", f"[GRBL] {resp}"))
+                continue
+
+            try:
+                if kind == "line":
+                    self.responses.put(("response", self.send_line(payload)))
+                elif kind == "jog":
+                    if payload[0] != self.jog_id:
+                        continue  # cancelled before it started: drop it
+                    self.responses.put(("response", self.stream_jog(*payload)))
+                elif kind == "file":
+                    errors = stream_gcode_file(self.port, payload, on_pause=self.wait_for_operator)
+                    self.responses.put(("response", f"Sent file: {payload} ({len(errors)} errors)"))
+                elif kind == "reset":
+                    self.realtime(b'\x18')
+                    time.sleep(1)
+                    self.port.reset_input_buffer()
+                    self.responses.put(("response", self.send_line("$X")))
+                elif kind == "setup":
+                    with self.blocking_reads():
+                        result = setup_grbl(self.port)
+                    self.responses.put(("response", result or "GRBL configured"))
+            except Exception as e:
+                self.responses.put(("error", f"{kind} failed: {e}"))
+
+
 class JogController:
     def __init__(self, debug=False):
         self.debug = debug
         self.ser = None
+        self.worker = None
         self.feedrate = 1000
         self.step_size = 1.0
 
@@ -21,6 +258,8 @@ class JogController:
                 time.sleep(2)
                 self.ser.reset_input_buffer()
                 send_gcode_line(self.ser, "G91")  # relative positioning
+                self.worker = SerialWorker(self.ser)
+                self.worker.start()
             except Exception as e:
                 print(f"Serial connection failed: {e}")
                 self.debug = True
@@ -30,33 +269,61 @@ class JogController:
             print(f"[DEBUG] Would send: {cmd}")
             return f"[DEBUG] {cmd}"
         else:
-            return send_gcode_line(self.ser, cmd)
+            self.worker.submit("line", cmd)
+            return f"Queued: {cmd}"
 
     def send_file(self, filepath):
         if self.debug:
             print(f"[DEBUG] Would send file: {filepath}")
             return f"[DEBUG] Sending file: {filepath}"
         else:
-            send_gcode_file(filepath)
-            return f"Sent file: {filepath}"
+            self.worker.submit("file", filepath)
+            return f"Sending file: {filepath}"
 
     def jog(self, axis, direction):
         distance = self.step_size * direction
         cmd = f"$J=G91 {axis}{distance} F{self.feedrate}"
         return self.send(cmd)
 
+    def start_jog(self, axis, direction):
+        if self.debug:
+            print(f"[DEBUG] Would start continuous jog {axis}{'+' if direction > 0 else '-'} F{self.feedrate}")
+            return f"[DEBUG] Jogging {axis}"
+        self.worker.start_jog(axis, direction, self.feedrate)
+        return f"Jogging {axis}{'+' if direction > 0 else '-'}"
+
+    def stop_jog(self):
+        if self.debug:
+            print("[DEBUG] Would send: jog cancel (0x85)")
+            return "[DEBUG] Jog cancel"
+        self.worker.stop_jog()
+        return "Jog cancel sent"
+
     def home(self):
         return self.send("$H")
 
+    def resume(self):
+        if self.debug:
+            print("[DEBUG] Would resume after M0")
+            return
+        self.worker.resume()
+
+    def move_syringe(self, direction):
+        # Off the GUI thread: a 1 ml move takes seconds
+        threading.Thread(target=move_motor, args=(1, direction), daemon=True).start()
+
     def reset(self):
         if self.debug:
             print("[DEBUG] Would send: Soft Reset")
             return "[DEBUG] Soft Reset"
-        self.ser.write(b'\x18')
-        self.ser.flush()
-        time.sleep(1)
-        self.ser.reset_input_buffer()
-        return self.send("$X")
+        self.worker.submit("reset")
+        return "Soft Reset queued"
+
+    def realtime(self, byte):
+        if self.debug:
+            print(f"[DEBUG] Would send real-time: {byte!r}")
+            return
+        self.worker.realtime(byte)
 
     def zero_all(self):
         return self.send("G10 L20 P1 X0 Y0 Z0")
@@ -64,19 +331,28 @@ class JogController:
     def send_gcode(self, cmd):
         return self.send(cmd)
 
-    def send_file(self, filepath):
-        if self.debug:
-            print(f"[DEBUG] Would send file: {filepath}")
-        else:
-            send_gcode_file(filepath)
-
     def setup(self):
         if not self.debug:
-            setup_grbl(self.ser)
+            self.worker.submit("setup")
         else:
             print("[DEBUG] Setup called")
 
+    def poll_responses(self):
+        """
+        Drains everything the worker has posted since the last call (never blocks).
+        """
+        results = []
+        if self.worker:
+            while True:
+                try:
+                    results.append(self.worker.responses.get_nowait())
+                except queue.Empty:
+                    break
+        return results
+
     def close(self):
+        if self.worker:
+            self.worker.stop()
         if self.ser:
             self.ser.close()
 
@@ -85,7 +361,28 @@ class JogGUI:
         self.controller = JogController(debug=DEBUG_MODE)
 
         root.title("GRBL Jog Controller")
+        self.root = root
         self.create_widgets(root)
+        self.root.after(GUI_POLL_MS, self.poll_controller)
+
+        # Hold-to-jog state: pending hold timer, whether a continuous jog is running,
+        # and pending key-release timer (to filter keyboard auto-repeat)
+        self.hold_job = None
+        self.continuous = False
+        self.active_key = None
+        self.release_job = None
+        for key in JOG_KEYS:
+            root.bind(f"<KeyPress-{key}>", self.on_key_press)
+            root.bind(f"<KeyRelease-{key}>", self.on_key_release)
+
+    def jog_button(self, parent, text, axis, direction):
+        """
+        Click for one step, hold for continuous jogging until release.
+        """
+        btn = ttk.Button(parent, text=text, width=6)
+        btn.bind("<ButtonPress-1>", lambda e: self.on_jog_press(axis, direction))
+        btn.bind("<ButtonRelease-1>", lambda e: self.on_jog_release(axis, direction))
+        return btn
 
     def create_widgets(self, root):
         frame = ttk.Frame(root, padding=10)
@@ -110,20 +407,16 @@ class JogGUI:
         jog_frame.grid(row=2, column=0, columnspan=3)
 
         # Z axis on the left
-        ttk.Button(jog_frame, text="↑ Z+", width=6, command=lambda: self.jog("Z", 1)).grid(row=0, column=0, rowspan=1,
-                                                                                           padx=5, pady=2)
-        ttk.Button(jog_frame, text="↓ Z-", width=6, command=lambda: self.jog("Z", -1)).grid(row=1, column=0, rowspan=1,
-                                                                                            padx=5, pady=2)
+        self.jog_button(jog_frame, "↑ Z+", "Z", 1).grid(row=0, column=0, rowspan=1, padx=5, pady=2)
+        self.jog_button(jog_frame, "↓ Z-", "Z", -1).grid(row=1, column=0, rowspan=1, padx=5, pady=2)
 
         # XY cross layout
-        ttk.Button(jog_frame, text="↑ Y+", width=6, command=lambda: self.jog("Y", 1)).grid(row=0, column=1,
-                                                                                           columnspan=2)
-        ttk.Button(jog_frame, text="← X-", width=6, command=lambda: self.jog("X", -1)).grid(row=1, column=1)
-        ttk.Button(jog_frame, text="→ X+", width=6, command=lambda: self.jog("X", 1)).grid(row=1, column=2)
-        ttk.Button(jog_frame, text="↓ Y-", width=6, command=lambda: self.jog("Y", -1)).grid(row=2, column=1,
-                                                                                            columnspan=2)
-
-        # Stop/resume button centered under
+        self.jog_button(jog_frame, "↑ Y+", "Y", 1).grid(row=0, column=1, columnspan=2)
+        self.jog_button(jog_frame, "← X-", "X", -1).grid(row=1, column=1)
+        self.jog_button(jog_frame, "→ X+", "X", 1).grid(row=1, column=2)
+        self.jog_button(jog_frame, "↓ Y-", "Y", -1).grid(row=2, column=1, columnspan=2)
+
+        # Jog cancel button centered under
         ttk.Button(jog_frame, text="⏹ Stop", command=self.stop_movement).grid(row=3, column=1, columnspan=2,
                                                                               pady=(5, 0))
 
@@ -150,6 +443,10 @@ class JogGUI:
         self.status.set("Ready")
         ttk.Label(frame, textvariable=self.status).grid(row=10, column=0, columnspan=3, pady=5)
 
+        # --- Live machine state from '?' status reports ---
+        self.machine_state = tk.StringVar(value="State: -")
+        ttk.Label(frame, textvariable=self.machine_state).grid(row=11, column=0, columnspan=3)
+
     def set_feedrate(self):
         try:
             val = float(self.feedrate_var.get())
@@ -159,13 +456,9 @@ class JogGUI:
             self.status.set("Invalid feedrate value")
 
     def stop_movement(self):
-        if self.controller.debug:
-            print("[DEBUG] Would send: ~ (resume/stop)")
-            self.status.set("[DEBUG] Stop (~) sent")
-        else:
-            self.controller.ser.write(b'~')
-            self.controller.ser.flush()
-            self.status.set("Stop (~) sent")
+        # '~' is cycle start and never stopped a jog; 0x85 cancels it
+        self.continuous = False
+        self.status.set(self.controller.stop_jog())
 
     def set_step(self):
         try:
@@ -186,6 +479,50 @@ class JogGUI:
         response = self.controller.jog(axis, direction)
         self.status.set(response)
 
+    def on_jog_press(self, axis, direction):
+        self.continuous = False
+        self.hold_job = self.root.after(HOLD_DELAY_MS, lambda: self.begin_continuous(axis, direction))
+
+    def on_jog_release(self, axis, direction):
+        if self.hold_job:
+            self.root.after_cancel(self.hold_job)
+            self.hold_job = None
+        if self.continuous:
+            self.stop_movement()
+        else:
+            self.jog(axis, direction)
+
+    def begin_continuous(self, axis, direction):
+        self.hold_job = None
+        self.continuous = True
+        self.status.set(self.controller.start_jog(axis, direction))
+
+    def on_key_press(self, event):
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return  # arrow keys belong to the text field
+        if self.release_job:
+            # Auto-repeat: the release we saw was not real
+            self.root.after_cancel(self.release_job)
+            self.release_job = None
+        if self.active_key == event.keysym:
+            return
+        if self.active_key:
+            self.stop_movement()
+        self.active_key = event.keysym
+        self.begin_continuous(*JOG_KEYS[event.keysym])
+
+    def on_key_release(self, event):
+        if self.active_key != event.keysym:
+            return
+        if self.release_job:
+            self.root.after_cancel(self.release_job)
+        self.release_job = self.root.after(KEY_RELEASE_MS, self.end_key_jog)
+
+    def end_key_jog(self):
+        self.release_job = None
+        self.active_key = None
+        self.stop_movement()
+
     def send_manual_gcode(self):
         cmd = self.manual_entry.get().strip()
         if cmd:
@@ -200,6 +537,41 @@ class JogGUI:
         else:
             self.status.set("Please enter a G-code file path")
 
+    def poll_controller(self):
+        for kind, payload in self.controller.poll_responses():
+            if kind == "status":
+                pos = payload["pos"]
+                if pos:
+                    self.machine_state.set(f"{payload['state']}  {payload['frame']} "
+                                           f"X{pos[0]:.3f} Y{pos[1]:.3f} Z{pos[2]:.3f}")
+                else:
+                    self.machine_state.set(payload["state"])
+            elif kind == "pause":
+                self.show_pause_dialog(payload)
+            else:
+                self.status.set(payload)
+        self.root.after(GUI_POLL_MS, self.poll_controller)
+
+    def show_pause_dialog(self, message):
+        """
+        M0 from a file job: syringe adjustment and Resume, in place of the terminal prompt.
+        """
+        self.status.set(message)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Paused")
+        dialog.transient(self.root)
+        ttk.Label(dialog, text=message, padding=10).pack()
+        ttk.Button(dialog, text="Syringe ↑", command=lambda: self.controller.move_syringe("up")).pack(fill="x")
+        ttk.Button(dialog, text="Syringe ↓", command=lambda: self.controller.move_syringe("down")).pack(fill="x")
+
+        def resume():
+            dialog.destroy()
+            self.controller.resume()
+            self.status.set("Resumed")
+
+        ttk.Button(dialog, text="Resume", command=resume).pack(fill="x", pady=(10, 0))
+        dialog.protocol("WM_DELETE_WINDOW", resume)
+
     def on_close(self):
         self.controller.close()
         root.destroy()
@@ -0,0 +1,76 @@
+# Machine settings shared by the sender and everything that only needs to know how the
+# machine behaves (the simulator, batch conversion). No serial or GPIO imports here, so
+# those keep working on hosts without the hardware libraries.
+
+import numpy as np
+
+'''
+$22=1      ; Enable homing cycle
+$23=3      ; Homing direction mask (Z+, X-, Y-)
+$5=1       ; Limit pins use pull-up resistors
+$21=1      ; Enable hard limits
+
+$100=40.00  ; X steps/mm
+$101=40.00  ; Y steps/mm
+$102=400.00 ; Z steps/mm
+$110=1000   ; X max rate (mm/min)
+$111=1000   ; Y max rate
+$112=500    ; Z max rate
+$130=650    ; X max travel (mm)
+$131=700    ; Y max travel
+$132=50     ; Z max travel
+
+'''
+
+GRBL_SETUP = [
+    "$22=0", "$23=3", "$5=1", "$21=0",
+    "$100=40.00", "$101=40.00", "$102=400.00",
+    "$110=1000", "$111=1000", "$112=500",
+    "$130=650", "$131=700", "$132=50"
+]
+
+# Syringe stepper (28BYJ-48 half-stepping, driven by syringe_stepper)
+STEPS_PER_ML = 512  # Adjust as needed (one step = one pass through the half-step sequence)
+HALF_STEPS_PER_STEP = 8  # length of syringe_stepper.sequence
+DISPENSE_AMOUNT = 10  # ml per pointillism dot, and per cell along a stroke
+LINE_FLOW = 0.05  # ml per mm of contour line, a thin line rather than a row of dots; tune on the machine
+
+# Half-step timing. The motor starts/stops at START_STEP_RATE and ramps up to MAX_STEP_RATE.
+START_STEP_RATE = 400.0   # half-steps/s (the old fixed 0.002 s delay was 500)
+MAX_STEP_RATE = 900.0     # half-steps/s
+STEP_ACCEL = 4000.0       # half-steps/s^2
+
+
+def build_step_schedule(half_steps, start_rate=START_STEP_RATE, max_rate=MAX_STEP_RATE, accel=STEP_ACCEL):
+    """
+    Trapezoidal ramp: times (s, relative to the first write) of every half-step plus a
+    final entry for when the last one has been held long enough to release the coils.
+    """
+    if half_steps <= 0:
+        return np.zeros(1)
+    # Half-steps needed to ramp from start_rate to max_rate, capped at half the move
+    n_acc = int(np.ceil((max_rate ** 2 - start_rate ** 2) / (2 * accel))) if max_rate > start_rate else 0
+    n_acc = min(n_acc, half_steps // 2)
+
+    acc_t = (np.sqrt(start_rate ** 2 + 2 * accel * np.arange(n_acc + 1)) - start_rate) / accel
+    acc_dt = np.diff(acc_t)
+    peak_rate = min(max_rate, np.sqrt(start_rate ** 2 + 2 * accel * n_acc))
+    cruise_dt = np.full(half_steps - 2 * n_acc, 1.0 / peak_rate)
+
+    intervals = np.concatenate((acc_dt, cruise_dt, acc_dt[::-1]))
+    return np.concatenate(([0.0], np.cumsum(intervals)))
+
+
+def dispense_duration(amount_ml):
+    """
+    Nominal time (s) move_motor takes for amount_ml.
+    """
+    return float(build_step_schedule(int(amount_ml * STEPS_PER_ML) * HALF_STEPS_PER_STEP)[-1])
+
+
+def drag_feedrate(length_mm, cells, amount_ml=DISPENSE_AMOUNT):
+    """
+    Feed (mm/min) at which a length_mm drag takes exactly as long as move_motor takes for
+    cells * amount_ml, so the paint is spread evenly over the whole stroke.
+    """
+    return 60.0 * length_mm / dispense_duration(amount_ml * cells)
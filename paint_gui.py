@@ -1,49 +1,312 @@
+import os
+import queue
+import threading
 import tkinter as tk
-from tkinter import messagebox
+from collections import deque
+from tkinter import filedialog, messagebox, ttk
 import numpy as np
 import tkinter.font as tkfont
+import image_processing as ip
+from image_processing import color_map, PointillismToolpath
+from gcode_sim import format_duration
 
 PIXEL_SIZE = 10
 ROWS = 50
 COLS = 40
+MAX_VIEW = 800  # largest canvas widget size (px); bigger grids are zoomed out or panned
+FRAME_MS = 16  # dirty cells are flushed to the bitmap at most this often (~60 Hz)
+ZOOM_LEVELS = (1, 2, 3, 4, 6, 8, 10, 12, 16, 24, 32)  # screen pixels per cell
+HISTORY_BYTES = 32 * 2 ** 20  # undo/redo memory cap; the oldest strokes are dropped past it
+IMPORT_REGION_SIZE = 5  # image pixels averaged into each imported cell
+PREVIEW_DELAY_MS = 300  # idle time after an edit before the path and time estimate refresh
+OVERLAY_TRAVEL = "#FF00FF"  # travel path overlay, a color that isn't in the palette
+OVERLAY_MAX_PIECES = 20000  # beyond this only the start of the path is drawn
+IMAGE_TYPES = [("Images", "*.jpg *.jpeg *.png *.bmp *.gif *.tif *.tiff *.webp"), ("All files", "*")]
+
+
+def palette_lut(widget, colors=color_map):
+    """
+    (n, 3) uint8 RGB lookup table for color IDs 0..n-1, resolving Tk color names.
+    """
+    lut = np.zeros((max(colors) + 1, 3), dtype=np.uint8)
+    for color_id, color in colors.items():
+        lut[color_id] = [c >> 8 for c in widget.winfo_rgb(color)]
+    return lut
+
+
+class BitmapCanvas:
+    """
+    Draws a grid of color IDs as one PhotoImage the size of the view instead of one canvas
+    item per cell. Changed cells are collected into a dirty rectangle and redrawn at most
+    every FRAME_MS; zoom (mouse wheel) and pan (right or middle drag) re-render the view.
+    """
+
+    def __init__(self, parent, data, lut, pixel_size=PIXEL_SIZE):
+        self.data = data
+        self.lut = lut
+        rows, cols = data.shape
+        self.zoom = max(1, min(pixel_size, MAX_VIEW // cols, MAX_VIEW // rows))
+        self.pan_x = self.pan_y = 0  # screen pixel of the grid's top-left corner, negated
+
+        width, height = cols * self.zoom, rows * self.zoom
+        self.canvas = tk.Canvas(parent, width=width, height=height, highlightthickness=0, bg="gray30")
+        self.photo = tk.PhotoImage(width=width, height=height)
+        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+        self.dirty = None  # (i0, i1, j0, j1) waiting for the next frame
+        self.frame_pending = False
+        self.overlay = None  # [(first cell, last cell), ...] drawn as the travel path
+
+        self.canvas.bind("<Configure>", self._resize)
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom_at(e.x, e.y, 1 if e.delta > 0 else -1))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_at(e.x, e.y, 1))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_at(e.x, e.y, -1))
+        for button in (2, 3):
+            self.canvas.bind(f"<Button-{button}>", self._pan_start)
+            self.canvas.bind(f"<B{button}-Motion>", self._pan_move)
+        self.redraw()
+
+    def bind(self, sequence, callback):
+        self.canvas.bind(sequence, callback)
+
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+
+    def cell_at(self, x, y):
+        """
+        Grid cell (i, j) under a canvas pixel, or None outside the grid.
+        """
+        i = (y + self.pan_y) // self.zoom
+        j = (x + self.pan_x) // self.zoom
+        rows, cols = self.data.shape
+        if 0 <= i < rows and 0 <= j < cols:
+            return int(i), int(j)
+        return None
+
+    def mark_dirty(self, i0, j0, i1=None, j1=None):
+        """
+        Queues cells [i0:i1, j0:j1] (one cell by default) for the next frame.
+        """
+        i1 = i0 + 1 if i1 is None else i1
+        j1 = j0 + 1 if j1 is None else j1
+        if self.dirty:
+            a0, a1, b0, b1 = self.dirty
+            i0, i1, j0, j1 = min(i0, a0), max(i1, a1), min(j0, b0), max(j1, b1)
+        self.dirty = (i0, i1, j0, j1)
+        if not self.frame_pending:
+            self.frame_pending = True
+            self.canvas.after(FRAME_MS, self._flush)
+
+    def _flush(self):
+        self.frame_pending = False
+        if self.dirty:
+            self._put_cells(*self.dirty)
+            self.dirty = None
+
+    def _visible_cells(self):
+        rows, cols = self.data.shape
+        width, height = self.photo.width(), self.photo.height()
+        i0 = max(self.pan_y // self.zoom, 0)
+        j0 = max(self.pan_x // self.zoom, 0)
+        i1 = min(-(-(self.pan_y + height) // self.zoom), rows)
+        j1 = min(-(-(self.pan_x + width) // self.zoom), cols)
+        return i0, i1, j0, j1
+
+    def _put_cells(self, i0, i1, j0, j1):
+        v0, v1, w0, w1 = self._visible_cells()
+        i0, i1, j0, j1 = max(i0, v0), min(i1, v1), max(j0, w0), min(j1, w1)
+        if i0 >= i1 or j0 >= j1:
+            return
+        x = j0 * self.zoom - self.pan_x
+        y = i0 * self.zoom - self.pan_y
+        rgb = self.lut[self.data[i0:i1, j0:j1]]
+        if self.zoom > 1:
+            rgb = rgb.repeat(self.zoom, axis=0).repeat(self.zoom, axis=1)
+        # Cells cut by the top/left edge of the view start off-screen and PhotoImage can't
+        # take negative offsets, so crop them; Tk clips the bottom/right itself
+        rgb = rgb[max(-y, 0):, max(-x, 0):]
+        ppm = b"P6 %d %d 255\n" % (rgb.shape[1], rgb.shape[0]) + rgb.tobytes()
+        self.photo.tk.call(self.photo.name, "put", ppm, "-format", "ppm", "-to", max(x, 0), max(y, 0))
+
+    def redraw(self):
+        """
+        Re-renders everything in view (after zoom, pan, resize or a bulk change).
+        """
+        self.dirty = None
+        self.photo.blank()
+        self._put_cells(*self._visible_cells())
+        self._draw_overlay()
+
+    def set_overlay(self, path):
+        """
+        Shows a painting order over the grid (None to hide it): strokes as thick lines, the
+        travel between pieces as one thin line ending in an arrow, a ring on the first piece.
+        """
+        self.overlay = path
+        self._draw_overlay()
+
+    def _draw_overlay(self):
+        self.canvas.delete("overlay")
+        if not self.overlay:
+            return
+        zoom = self.zoom
+
+        def center(i, j):
+            return j * zoom - self.pan_x + zoom / 2, i * zoom - self.pan_y + zoom / 2
+
+        travel = []
+        for first, last in self.overlay[:OVERLAY_MAX_PIECES]:
+            travel.extend(center(*first))
+            if first != last:
+                self.canvas.create_line(*center(*first), *center(*last), fill=OVERLAY_TRAVEL,
+                                        width=max(2, zoom // 3), tags="overlay")
+                travel.extend(center(*last))
+        if len(travel) >= 4:
+            self.canvas.create_line(*travel, fill=OVERLAY_TRAVEL, arrow=tk.LAST, tags="overlay")
+        x, y = travel[:2]
+        r = max(3, zoom / 2)
+        self.canvas.create_oval(x - r, y - r, x + r, y + r, outline=OVERLAY_TRAVEL, width=2, tags="overlay")
+
+    def _clamp_pan(self):
+        rows, cols = self.data.shape
+        width, height = self.photo.width(), self.photo.height()
+        # Keep at least half the view on the grid
+        self.pan_x = min(max(self.pan_x, -width // 2), max(cols * self.zoom - width // 2, -width // 2))
+        self.pan_y = min(max(self.pan_y, -height // 2), max(rows * self.zoom - height // 2, -height // 2))
+
+    def zoom_at(self, x, y, steps):
+        """
+        Steps through ZOOM_LEVELS keeping the cell under (x, y) in place.
+        """
+        levels = ZOOM_LEVELS
+        k = min(range(len(levels)), key=lambda n: abs(levels[n] - self.zoom))
+        new = levels[min(max(k + steps, 0), len(levels) - 1)]
+        if new == self.zoom:
+            return
+        # Grid position under the cursor, in cells, stays put
+        gx = (x + self.pan_x) / self.zoom
+        gy = (y + self.pan_y) / self.zoom
+        self.zoom = new
+        self.pan_x = int(round(gx * new - x))
+        self.pan_y = int(round(gy * new - y))
+        self._clamp_pan()
+        self.redraw()
+
+    def _pan_start(self, event):
+        self._pan_anchor = (event.x + self.pan_x, event.y + self.pan_y)
+
+    def _pan_move(self, event):
+        self.pan_x = self._pan_anchor[0] - event.x
+        self.pan_y = self._pan_anchor[1] - event.y
+        self._clamp_pan()
+        self.redraw()
+
+    def _resize(self, event):
+        if (event.width, event.height) != (self.photo.width(), self.photo.height()):
+            self.photo.configure(width=event.width, height=event.height)
+            self._clamp_pan()
+            self.redraw()
+
+
+class EditHistory:
+    """
+    Undo/redo for a color grid, one entry per stroke (or clear): the flat indices of the
+    cells it changed and their colors before and after, as compact NumPy arrays. Once both
+    stacks together hold more than max_bytes the oldest undo entries are dropped.
+    """
+
+    def __init__(self, data, max_bytes=HISTORY_BYTES):
+        self.data = data
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+        self._pending = {}  # flat index -> color before the stroke in progress
+
+    def record(self, i, j, old_color):
+        """
+        Notes a cell about to change in the current stroke (only its first old color counts).
+        """
+        self._pending.setdefault(i * self.data.shape[1] + j, old_color)
+
+    def commit(self):
+        """
+        Closes the current stroke into one undo entry. Returns its indices (None if empty).
+        """
+        if not self._pending:
+            return None
+        n = len(self._pending)
+        idx = np.fromiter(self._pending.keys(), dtype=np.int32, count=n)
+        old = np.fromiter(self._pending.values(), dtype=np.uint8, count=n)
+        self._pending = {}
+        return self.push(idx, old, self.data.flat[idx].astype(np.uint8))
+
+    def push(self, idx, old, new):
+        """
+        Adds an edit that has already been applied to the grid.
+        """
+        keep = old != new
+        if not keep.any():
+            return None
+        entry = (idx[keep], old[keep], new[keep])
+        for redo in self.redo_stack:
+            self.nbytes -= _entry_bytes(redo)
+        self.redo_stack.clear()
+        self.undo_stack.append(entry)
+        self.nbytes += _entry_bytes(entry)
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= _entry_bytes(self.undo_stack.popleft())
+        return entry[0]
+
+    def undo(self):
+        """
+        Reverts the last entry. Returns the indices it touched, or None if there was nothing.
+        """
+        if not self.undo_stack:
+            return None
+        idx, old, new = entry = self.undo_stack.pop()
+        self.data.flat[idx] = old
+        self.redo_stack.append(entry)
+        return idx
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        idx, old, new = entry = self.redo_stack.pop()
+        self.data.flat[idx] = new
+        self.undo_stack.append(entry)
+        return idx
+
+
+def _entry_bytes(entry):
+    return sum(a.nbytes for a in entry)
 
-color_map = {
-    0: 'red',
-    1: 'yellow',
-    2: 'blue',
-    3: '#4B0082',
-    4: '#90EE90',
-    5: 'black',
-    6: 'gray',
-    7: '#8A3324',
-    8: '#FF6100',
-    9: '#006400',
-    10: 'white',
-}
 
 class PaintCNCApp:
-    def __init__(self, root):
+    def __init__(self, root, rows=ROWS, cols=COLS, pixel_size=PIXEL_SIZE):
         self.root = root
         self.root.title("CNC Paint Designer")
 
-        self.canvas_data = np.full((ROWS, COLS), 10)  # default white
+        self.canvas_data = np.full((rows, cols), 10)  # default white
         self.current_color_id = 0
 
-        self.paint_history = []  # Stack for undo: store (i, j, old_color_id)
+        self.history = EditHistory(self.canvas_data)  # one undo step per stroke
+        self.toolpath = None  # kept between exports so only edited colors are regenerated
+        self.preview_toolpath = None  # only touched by the preview worker thread
+        self.results = queue.Queue()  # (callback, result, error) from worker threads
+        self.preview_after = None
+        self.preview_running = False
+        self.preview_again = False
+        self.last_cell = None  # previous cell of a drag, so fast strokes have no gaps
 
-        self.canvas = tk.Canvas(root, width=COLS * PIXEL_SIZE, height=ROWS * PIXEL_SIZE)
-        self.canvas.pack(side=tk.LEFT)
-
-        self.rects = [[None for _ in range(COLS)] for _ in range(ROWS)]
-        for i in range(ROWS):
-            for j in range(COLS):
-                x0, y0 = j * PIXEL_SIZE, i * PIXEL_SIZE
-                x1, y1 = x0 + PIXEL_SIZE, y0 + PIXEL_SIZE
-                rect = self.canvas.create_rectangle(x0, y0, x1, y1, fill=color_map[10], outline="")
-                self.rects[i][j] = rect
+        self.canvas = BitmapCanvas(root, self.canvas_data, palette_lut(root), pixel_size)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         self.canvas.bind("<Button-1>", self.paint_pixel)
         self.canvas.bind("<B1-Motion>", self.paint_pixel)
+        self.canvas.bind("<ButtonRelease-1>", self.end_stroke)
+        root.bind("<Control-z>", lambda e: self.undo_paint())
+        root.bind("<Control-y>", lambda e: self.redo_paint())
+        root.bind("<Control-Z>", lambda e: self.redo_paint())  # Ctrl+Shift+Z
 
         self.palette_frame = tk.Frame(root)
         self.palette_frame.pack(side=tk.RIGHT, padx=10)
@@ -86,7 +349,8 @@ class PaintCNCApp:
         # Initially highlight the selected color button
         self.update_color_buttons()
 
-        tk.Button(self.palette_frame, text="Undo", command=self.undo_paint).pack(pady=5)
+        tk.Button(self.palette_frame, text="Undo", command=self.undo_paint).pack(pady=(5, 0))
+        tk.Button(self.palette_frame, text="Redo", command=self.redo_paint).pack(pady=(2, 5))
 
         # Add filename label and entry before Export button
         tk.Label(self.palette_frame, text="Filename:").pack(pady=(20, 2))
@@ -94,12 +358,35 @@ class PaintCNCApp:
         self.filename_entry.insert(0, "paint_canvas.gcode")  # default filename
         self.filename_entry.pack(pady=(0, 10), fill='x')
 
+        self.optimize_path_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.palette_frame, text="Optimize path", variable=self.optimize_path_var,
+                       command=self.schedule_preview).pack(pady=2)
+
         tk.Button(self.palette_frame, text="Export G-code", command=self.export_gcode).pack(pady=5)
         tk.Button(self.palette_frame, text="Clear Canvas", command=self.clear_canvas).pack(pady=5)
 
+        self.import_button = tk.Button(self.palette_frame, text="Import image", command=self.import_image)
+        self.import_button.pack(pady=(20, 2))
+        self.progress = ttk.Progressbar(self.palette_frame, mode="indeterminate", length=120)
+        self.progress.pack(pady=2)
+        self.status_var = tk.StringVar()
+        tk.Label(self.palette_frame, textvariable=self.status_var).pack()
+
+        # Travel path of the selected color and a paint time estimate, refreshed after edits
+        self.show_path_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.palette_frame, text="Show path", variable=self.show_path_var,
+                       command=self.toggle_path).pack(pady=(20, 2))
+        self.estimate_var = tk.StringVar(value="Est. paint time: -")
+        tk.Label(self.palette_frame, textvariable=self.estimate_var).pack(pady=2)
+
+        self.poll_results()
+        self.schedule_preview()
+
     def set_color(self, color_id):
         self.current_color_id = color_id
         self.update_color_buttons()
+        if self.show_path_var.get():
+            self.schedule_preview()
 
     def update_color_buttons(self):
         # Highlight selected color button, others normal
@@ -110,30 +397,174 @@ class PaintCNCApp:
                 btn.config(relief=tk.RAISED, bd=1)
 
     def paint_pixel(self, event):
-        j = event.x // PIXEL_SIZE
-        i = event.y // PIXEL_SIZE
-        if 0 <= i < ROWS and 0 <= j < COLS:
+        cell = self.canvas.cell_at(event.x, event.y)
+        if cell is None:
+            self.last_cell = None
+            return
+        # Motion events skip cells when dragging fast: fill in the straight line between them
+        cells = [cell]
+        if self.last_cell is not None:
+            (i0, j0), (i1, j1) = self.last_cell, cell
+            n = max(abs(i1 - i0), abs(j1 - j0))
+            if n > 1:
+                steps = np.linspace(0, 1, n + 1)[1:]
+                cells = zip(np.rint(i0 + (i1 - i0) * steps).astype(int).tolist(),
+                            np.rint(j0 + (j1 - j0) * steps).astype(int).tolist())
+        self.last_cell = cell
+
+        new_color = self.current_color_id
+        for i, j in cells:
             old_color = self.canvas_data[i, j]
-            new_color = self.current_color_id
             if old_color != new_color:
-                self.paint_history.append((i, j, old_color))  # Save for undo
+                self.history.record(i, j, old_color)  # Save for undo
                 self.canvas_data[i, j] = new_color
-                self.canvas.itemconfig(self.rects[i][j], fill=color_map[new_color])
+                self.canvas.mark_dirty(i, j)
+
+    def end_stroke(self, event=None):
+        self.last_cell = None
+        if self.history.commit() is not None:
+            self.schedule_preview()
+
+    def mark_cells_dirty(self, idx):
+        # One bitmap update covering every cell an undo step touched
+        i, j = np.divmod(idx, self.canvas_data.shape[1])
+        self.canvas.mark_dirty(int(i.min()), int(j.min()), int(i.max()) + 1, int(j.max()) + 1)
 
     def undo_paint(self):
-        if self.paint_history:
-            i, j, old_color = self.paint_history.pop()
-            self.canvas_data[i, j] = old_color
-            self.canvas.itemconfig(self.rects[i][j], fill=color_map[old_color])
-        else:
+        self.end_stroke()
+        idx = self.history.undo()
+        if idx is None:
             messagebox.showinfo("Undo", "Nothing to undo.")
+        else:
+            self.mark_cells_dirty(idx)
+            self.schedule_preview()
+
+    def redo_paint(self):
+        self.end_stroke()
+        idx = self.history.redo()
+        if idx is None:
+            messagebox.showinfo("Redo", "Nothing to redo.")
+        else:
+            self.mark_cells_dirty(idx)
+            self.schedule_preview()
 
     def clear_canvas(self):
+        self.end_stroke()
+        idx = np.flatnonzero(self.canvas_data.ravel() != 10).astype(np.int32)
+        old = self.canvas_data.flat[idx].astype(np.uint8)
         self.canvas_data.fill(10)
-        self.paint_history.clear()
-        for i in range(ROWS):
-            for j in range(COLS):
-                self.canvas.itemconfig(self.rects[i][j], fill=color_map[10])
+        self.history.push(idx, old, np.full(len(idx), 10, dtype=np.uint8))  # undoable
+        self.canvas.redraw()
+        self.schedule_preview()
+
+    def run_in_background(self, work, done):
+        """
+        Runs work() on a worker thread, then done(result, error) back on the Tk thread.
+        """
+        def target():
+            try:
+                self.results.put((done, work(), None))
+            except Exception as e:
+                self.results.put((done, None, e))
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def poll_results(self):
+        # Tk isn't thread-safe: workers hand their results over through the queue
+        while True:
+            try:
+                done, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            done(result, error)
+        self.root.after(50, self.poll_results)
+
+    def import_image(self):
+        path = filedialog.askopenfilename(title="Import image", filetypes=IMAGE_TYPES)
+        if not path:
+            return
+        rows, cols = self.canvas_data.shape
+        output_size = (cols * IMPORT_REGION_SIZE, rows * IMPORT_REGION_SIZE)
+        self.import_button.config(state=tk.DISABLED)
+        self.status_var.set(f"Importing {os.path.basename(path)}...")
+        self.progress.start(10)
+
+        def work():
+            _, dot_matrix = ip.load_and_quantize_cached(path, output_size=output_size, region_size=IMPORT_REGION_SIZE,
+                                                        seed=0, color_space="oklab")
+            return dot_matrix
+
+        self.run_in_background(work, lambda dots, error: self.import_done(path, dots, error))
+
+    def import_done(self, path, dot_matrix, error):
+        self.progress.stop()
+        self.import_button.config(state=tk.NORMAL)
+        if error is None and dot_matrix.shape != self.canvas_data.shape:
+            error = ValueError(f"got a {dot_matrix.shape} dot matrix for a {self.canvas_data.shape} canvas")
+        if error is not None:
+            self.status_var.set("")
+            messagebox.showerror("Import failed", str(error))
+            return
+
+        # One undo step, like any other edit
+        self.end_stroke()
+        idx = np.flatnonzero(self.canvas_data.ravel() != dot_matrix.ravel()).astype(np.int32)
+        old = self.canvas_data.flat[idx].astype(np.uint8)
+        self.canvas_data[...] = dot_matrix
+        self.history.push(idx, old, self.canvas_data.flat[idx].astype(np.uint8))
+        self.canvas.redraw()
+        self.status_var.set(f"Imported {os.path.basename(path)}")
+        self.schedule_preview()
+
+    def toggle_path(self):
+        if not self.show_path_var.get():
+            self.canvas.set_overlay(None)
+        self.schedule_preview()
+
+    def schedule_preview(self):
+        """
+        Refreshes the path overlay and time estimate once editing pauses for PREVIEW_DELAY_MS.
+        """
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DELAY_MS, self.start_preview)
+
+    def start_preview(self):
+        self.preview_after = None
+        if self.preview_running:
+            self.preview_again = True  # one more round with the latest edits when this one ends
+            return
+        self.preview_running = True
+        snapshot = self.canvas_data.copy()
+        color = self.current_color_id if self.show_path_var.get() and self.current_color_id != ip.WHITE else None
+        options = dict(optimize_path=self.optimize_path_var.get())
+
+        def work():
+            # Same engine as export, so only the colors edited since the last preview are rebuilt and re-timed
+            if self.preview_toolpath is None:
+                self.preview_toolpath = PointillismToolpath(snapshot, verbose=False, **options)
+            else:
+                self.preview_toolpath.set_options(**options)
+                self.preview_toolpath.update(snapshot)
+            report = self.preview_toolpath.estimate()
+            path = self.preview_toolpath.pass_path(color) if color is not None else None
+            return report, path
+
+        self.run_in_background(work, self.preview_done)
+
+    def preview_done(self, result, error):
+        self.preview_running = False
+        if error is not None:
+            self.estimate_var.set(f"Est. paint time: failed ({error})")
+        else:
+            report, path = result
+            self.estimate_var.set(f"Est. paint time: {format_duration(report['total_time'])}\n"
+                                  f"{report['cells']} dots, {report['pauses']} pauses")
+            if self.show_path_var.get():
+                self.canvas.set_overlay(path)
+        if self.preview_again:
+            self.preview_again = False
+            self.schedule_preview()
 
     def export_gcode(self):
         filename = self.filename_entry.get().strip()
@@ -142,65 +573,33 @@ class PaintCNCApp:
         if not filename.lower().endswith(".gcode"):
             filename += ".gcode"
 
-        gcode_lines = generate_pointillism_gcode(self.canvas_data)
+        options = dict(optimize_path=self.optimize_path_var.get())
+        if self.toolpath is None:
+            self.toolpath = PointillismToolpath(self.canvas_data, **options)
+        else:
+            self.toolpath.set_options(**options)
+            self.toolpath.update(self.canvas_data)
+        gcode_lines = self.toolpath.iter_gcode()
         try:
-            import os
             os.makedirs("output", exist_ok=True)
             filepath = f"output/{filename}"
-            with open(filepath, "w") as f:
-                f.write("\n".join(gcode_lines))
+            with open(filepath, "w", buffering=1 << 16) as f:
+                for line in gcode_lines:
+                    f.write(line + "\n")
             messagebox.showinfo("Success", f"G-code saved to {filepath}")
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
 
-def generate_pointillism_gcode(color_matrix, feedrate=800, z_height=0):
-    gcode = [
-        "G90",
-        "G10 L20 P1 X0 Y0 Z0",
-        "G1 Z3 F500",
-        "G0 X-100 F800",
-        "M0 ; Pause to change color"
-    ]
-
-    rows = color_matrix.shape[0]  # 50
-    cols = color_matrix.shape[1]  # 40
-
-    start_x = 2.5    # mm, positive increasing X start
-    start_y = -2.5   # mm, negative decreasing Y start
-    step = 5         # mm per pixel
-    vertical_color_spacing = 5  # vertical gap per color block
-
-    for color_index in range(10):
-        gcode.append(f"; --- Starting color: {color_map[color_index]} ---")
-
-        # vertical offset pushes the whole block further down (more negative)
-        color_y_offset = -vertical_color_spacing * color_index
-
-        for i in range(rows):
-            for j in range(cols):
-                if int(color_matrix[i, j]) == color_index:
-                    x_pos = start_x + j * step
-                    y_pos = start_y - i * step + color_y_offset  # negative Y, going down
-
-                    gcode.append(f"G0 X{x_pos:.2f} F{feedrate}")
-                    gcode.append(f"G0 Y{y_pos:.2f} F{feedrate}")
-                    gcode.append(";DISPENSE")
-                    gcode.append(f"G1 Z{z_height:.2f} F500")
-                    gcode.append("G1 Z3 F500")
-
-        gcode.append("G1 Z5 F1000")
-        gcode.append("G0 X-100 F800")
-        gcode.append("G0 Y0 F800")
-        gcode.append("M0 ; Pause to change color")
-
-    return gcode
-
-
-
 if __name__ == "__main__":
-    import os
+    import argparse
+    parser = argparse.ArgumentParser(description="Draw a dot painting and export it as G-code.")
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--cols", type=int, default=COLS)
+    parser.add_argument("--pixel-size", type=int, default=PIXEL_SIZE, help="initial screen pixels per cell")
+    args = parser.parse_args()
+
     os.makedirs("output", exist_ok=True)
     root = tk.Tk()
-    app = PaintCNCApp(root)
+    app = PaintCNCApp(root, rows=args.rows, cols=args.cols, pixel_size=args.pixel_size)
     root.mainloop()
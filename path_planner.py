@@ -0,0 +1,252 @@
+import math
+import time
+
+# Dots are visited one color pass at a time. The generators move X and then Y
+# as two separate G0 lines, so the real travel between dots is Manhattan.
+METRICS = ("manhattan", "euclidean")
+
+
+def _dist_fn(metric):
+    if metric == "manhattan":
+        return lambda ax, ay, bx, by: abs(ax - bx) + abs(ay - by)
+    if metric == "euclidean":
+        return lambda ax, ay, bx, by: math.hypot(ax - bx, ay - by)
+    raise ValueError(f"Unknown metric: {metric} (expected one of {METRICS})")
+
+
+def travel_distance(points, start=(0.0, 0.0), metric="manhattan"):
+    """
+    Total travel (mm) to visit points in the given order, starting from start.
+    """
+    dist = _dist_fn(metric)
+    total = 0.0
+    px, py = start
+    for x, y in points:
+        total += dist(px, py, x, y)
+        px, py = x, y
+    return total
+
+
+class _Grid:
+    """
+    Spatial hash of points so nearest neighbor lookups only touch nearby cells.
+    """
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        n = len(xs)
+        span = max(max(xs) - min(xs), max(ys) - min(ys), 1e-9)
+        self.cell = max(span / max(math.sqrt(n), 1.0), 1e-9)
+        self.min_x = min(xs)
+        self.min_y = min(ys)
+        self.max_ring = int(span / self.cell) + 2
+        self.buckets = {}
+        for idx in range(n):
+            self.buckets.setdefault(self.key(xs[idx], ys[idx]), []).append(idx)
+
+    def key(self, x, y):
+        return (int((x - self.min_x) // self.cell), int((y - self.min_y) // self.cell))
+
+    def ring(self, cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
+
+    def remove(self, idx):
+        k = self.key(self.xs[idx], self.ys[idx])
+        bucket = self.buckets[k]
+        bucket.remove(idx)
+        if not bucket:
+            del self.buckets[k]
+
+    def nearest(self, x, y, dist):
+        """
+        Closest remaining point to (x, y), or None once the grid is empty.
+        """
+        if not self.buckets:
+            return None
+        cx, cy = self.key(x, y)
+        best, best_d = None, math.inf
+        for r in range(self.max_ring + abs(cx) + abs(cy) + 1):
+            for k in self.ring(cx, cy, r):
+                for idx in self.buckets.get(k, ()):
+                    d = dist(x, y, self.xs[idx], self.ys[idx])
+                    if d < best_d:
+                        best, best_d = idx, d
+            # Anything in a further ring is at least r cells away
+            if best is not None and best_d <= r * self.cell:
+                break
+        return best
+
+    def neighbors(self, idx, k, dist):
+        """
+        Roughly the k closest points to idx (excluding itself).
+        """
+        x, y = self.xs[idx], self.ys[idx]
+        cx, cy = self.key(x, y)
+        found = []
+        r = 0
+        while r <= self.max_ring:
+            for key in self.ring(cx, cy, r):
+                found.extend(o for o in self.buckets.get(key, ()) if o != idx)
+            r += 1
+            if len(found) >= k:
+                # One more ring so corner points are not missed
+                for key in self.ring(cx, cy, r):
+                    found.extend(o for o in self.buckets.get(key, ()) if o != idx)
+                break
+        found.sort(key=lambda o: dist(x, y, self.xs[o], self.ys[o]))
+        return found[:k]
+
+
+def nearest_neighbor_order(points, start=(0.0, 0.0), metric="manhattan"):
+    """
+    Greedy nearest neighbor tour over points from start. Returns point indices.
+    """
+    if not points:
+        return []
+    dist = _dist_fn(metric)
+    xs = [float(p[0]) for p in points]
+    ys = [float(p[1]) for p in points]
+    grid = _Grid(xs, ys)
+
+    order = []
+    x, y = start
+    while True:
+        idx = grid.nearest(x, y, dist)
+        if idx is None:
+            break
+        grid.remove(idx)
+        order.append(idx)
+        x, y = xs[idx], ys[idx]
+    return order
+
+
+def improve_order(points, order, start=(0.0, 0.0), metric="manhattan", time_budget=1.0, neighbors=8):
+    """
+    Improves an open tour with neighbor-list 2-opt and Or-opt moves until no move
+    helps or time_budget (seconds) runs out. The start position stays fixed.
+    """
+    if len(order) < 3:
+        return list(order)
+    deadline = time.perf_counter() + time_budget
+    dist = _dist_fn(metric)
+
+    # Node 0 is the fixed start, point i is node i + 1
+    xs = [float(start[0])] + [float(p[0]) for p in points]
+    ys = [float(start[1])] + [float(p[1]) for p in points]
+    grid = _Grid(xs[1:], ys[1:])
+    neigh = [[]] + [[o + 1 for o in grid.neighbors(i, neighbors, dist)] for i in range(len(points))]
+
+    tour = [0] + [i + 1 for i in order]
+    n = len(tour)
+    pos = [0] * n
+    for p, node in enumerate(tour):
+        pos[node] = p
+
+    def d(a, b):
+        return dist(xs[a], ys[a], xs[b], ys[b])
+
+    def two_opt():
+        improved = False
+        for i in range(n - 1):
+            a, b = tour[i], tour[i + 1]
+            d_ab = d(a, b)
+            for c in neigh[a]:
+                j = pos[c]
+                if j <= i + 1:
+                    continue
+                if j == n - 1:
+                    delta = d(a, c) - d_ab
+                else:
+                    e = tour[j + 1]
+                    delta = d(a, c) + d(b, e) - d_ab - d(c, e)
+                if delta < -1e-9:
+                    tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                    for p in range(i + 1, j + 1):
+                        pos[tour[p]] = p
+                    improved = True
+                    a, b = tour[i], tour[i + 1]
+                    d_ab = d(a, b)
+            if time.perf_counter() > deadline:
+                break
+        return improved
+
+    def or_opt():
+        improved = False
+        for seg_len in (1, 2, 3):
+            s = 1
+            while s + seg_len <= n:
+                seg = tour[s:s + seg_len]
+                p = tour[s - 1]
+                q = tour[s + seg_len] if s + seg_len < n else None
+                gain = d(p, seg[0])
+                if q is not None:
+                    gain += d(seg[-1], q) - d(p, q)
+
+                best = None
+                for c in set(neigh[seg[0]] + neigh[seg[-1]]):
+                    k = pos[c]
+                    # Insert between tour[k] and tour[k + 1], outside the segment
+                    if s - 1 <= k < s + seg_len:
+                        continue
+                    nxt = tour[k + 1] if k + 1 < n else None
+                    for x, y, rev in ((seg[0], seg[-1], False), (seg[-1], seg[0], True)):
+                        add = d(tour[k], x)
+                        if nxt is not None:
+                            add += d(y, nxt) - d(tour[k], nxt)
+                        if add < gain - 1e-9 and (best is None or add < best[0]):
+                            best = (add, k, rev)
+
+                if best is not None:
+                    _, k, rev = best
+                    anchor = tour[k]
+                    moved = seg[::-1] if rev else seg
+                    del tour[s:s + seg_len]
+                    at = tour.index(anchor, max(k - seg_len, 0)) + 1
+                    tour[at:at] = moved
+                    for idx in range(min(s, at), n):
+                        pos[tour[idx]] = idx
+                    improved = True
+                s += 1
+                if time.perf_counter() > deadline:
+                    return improved
+        return improved
+
+    while time.perf_counter() < deadline:
+        changed = two_opt()
+        if time.perf_counter() >= deadline:
+            break
+        changed = or_opt() or changed
+        if not changed:
+            break
+
+    return [node - 1 for node in tour[1:]]
+
+
+def plan_dot_order(points, start=(0.0, 0.0), metric="manhattan", time_budget=1.0):
+    """
+    Orders one color pass of dots to cut travel: nearest neighbor, then 2-opt/Or-opt.
+    Returns (ordered points, travel before, travel after) with travel in mm.
+    """
+    points = [tuple(p) for p in points]
+    before = travel_distance(points, start, metric)
+    if len(points) < 2:
+        return points, before, before
+
+    order = nearest_neighbor_order(points, start, metric)
+    order = improve_order(points, order, start, metric, time_budget)
+    ordered = [points[i] for i in order]
+    after = travel_distance(ordered, start, metric)
+
+    # Never hand back something worse than the raster order
+    if after > before:
+        return points, before, before
+    return ordered, before, after
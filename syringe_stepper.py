@@ -1,8 +1,15 @@
-import RPi.GPIO as GPIO
 import time
 import sys
 import termios
 import tty
+import numpy as np
+
+from machine_config import STEPS_PER_ML, build_step_schedule
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # plain Linux box: fall back to a backend that drives nothing
+    GPIO = None
 
 # GPIO pins controlling the ULN2003 inputs
 pins = [17, 18, 27, 22]
@@ -19,36 +26,129 @@ sequence = [
     [0,0,0,1]
 ]
 
-GPIO.setmode(GPIO.BCM)
-for pin in pins:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, 0)
+SPIN_MARGIN = 0.0005      # s before each deadline spent spinning instead of sleeping
 
 
-def move_motor(amount_ml, direction="up"):
+class RPiGPIOBackend:
     """
-    Move stepper motor up or down based on amount (ml) and direction.
+    Drives the ULN2003 inputs through RPi.GPIO, writing all pins in one call.
     """
-    steps_per_ml = 512  # Adjust as needed
-    steps = int(amount_ml * steps_per_ml)
-    delay = 0.002
 
-    if direction == "down":
-        step_sequence = reversed(sequence)
-    else:
-        step_sequence = sequence
+    def __init__(self, pins):
+        self.pins = list(pins)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.pins, GPIO.OUT, initial=0)
+
+    def write(self, values):
+        GPIO.output(self.pins, values)
+
+    def release(self):
+        GPIO.output(self.pins, [0] * len(self.pins))
+
+
+class RecordingBackend:
+    """
+    Stands in for the GPIO pins and records (perf_counter time, values) for every write,
+    so step timing and jitter can be measured without a Pi.
+    """
+
+    def __init__(self, pins):
+        self.pins = list(pins)
+        self.events = []
+
+    def write(self, values):
+        self.events.append((time.perf_counter(), tuple(values)))
+
+    def release(self):
+        self.write([0] * len(self.pins))
+
+
+class NullBackend:
+    """
+    No pins at all: keeps move_motor's timing on hosts without GPIO (sender tests, batch
+    jobs) without holding on to anything.
+    """
+
+    def __init__(self, pins):
+        self.pins = list(pins)
+
+    def write(self, values):
+        pass
+
+    def release(self):
+        pass
 
-    print(f"Moving {direction} for {amount_ml} ml -> {steps} steps")
 
+# RecordingBackend is only for measure_jitter: as a global fallback it would keep every step forever
+backend = RPiGPIOBackend(pins) if GPIO else NullBackend(pins)
+backend.release()
+
+
+def build_waveform(half_steps, direction="up"):
+    """
+    Pin values for every half-step, precomputed so the timing loop only writes.
+    """
+    step_sequence = sequence[::-1] if direction == "down" else sequence
+    return np.tile(np.array(step_sequence, dtype=np.uint8), (half_steps // len(sequence) + 1, 1))[:half_steps].tolist()
+
+
+def run_waveform(waveform, schedule, gpio=None):
+    """
+    Writes each waveform entry at its absolute deadline: sleep until just before it,
+    then spin, so late wakeups never accumulate into drift. Returns the start time.
+    """
+    gpio = gpio or backend
+    perf_counter = time.perf_counter
+    start = perf_counter()
     try:
-        for _ in range(steps):
-            for step in step_sequence:
-                for pin, val in zip(pins, step):
-                    GPIO.output(pin, val)
-                time.sleep(delay)
+        for t, values in zip(schedule.tolist(), waveform):
+            deadline = start + t
+            remaining = deadline - perf_counter()
+            if remaining > SPIN_MARGIN:
+                time.sleep(remaining - SPIN_MARGIN)
+            while perf_counter() < deadline:
+                pass
+            gpio.write(values)
+        # Hold the last half-step before de-energizing
+        deadline = start + schedule[-1]
+        while perf_counter() < deadline:
+            pass
     finally:
-        for pin in pins:
-            GPIO.output(pin, 0)
+        gpio.release()
+    return start
+
+
+def move_motor(amount_ml, direction="up", gpio=None):
+    """
+    Move stepper motor up or down based on amount (ml) and direction.
+    """
+    steps = int(amount_ml * STEPS_PER_ML)
+    half_steps = steps * len(sequence)
+
+    print(f"Moving {direction} for {amount_ml} ml -> {steps} steps")
+
+    waveform = build_waveform(half_steps, direction)
+    schedule = build_step_schedule(half_steps)
+    return run_waveform(waveform, schedule, gpio)
+
+def measure_jitter(amount_ml=0.5, direction="up"):
+    """
+    Runs a move against a RecordingBackend and returns step timing error stats in microseconds.
+    """
+    recorder = RecordingBackend(pins)
+    half_steps = int(amount_ml * STEPS_PER_ML) * len(sequence)
+    schedule = build_step_schedule(half_steps)
+    start = run_waveform(build_waveform(half_steps, direction), schedule, recorder)
+
+    actual = np.array([t for t, _ in recorder.events[:half_steps]]) - start
+    error_us = (actual - schedule[:half_steps]) * 1e6
+    return {
+        "half_steps": half_steps,
+        "mean_us": float(error_us.mean()),
+        "p99_us": float(np.percentile(error_us, 99)),
+        "max_us": float(error_us.max()),
+        "duration_s": float(recorder.events[-1][0] - start),
+    }
 
 def get_key():
     """Read a single keypress from stdin and return it."""